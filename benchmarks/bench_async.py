@@ -0,0 +1,130 @@
+"""
+Throughput of one gunicorn worker in each WORKER_MODE (see gunicorn.conf.py)
+when every request waits on Spotify.
+
+    python benchmarks/bench_async.py [--latency 0.1] [--clients 200] [--duration 10]
+
+Starts the fake Spotify API, then for each mode runs `gunicorn main:app`
+with a single worker and keeps --clients logged in requests to /playlists
+(one Spotify round trip each) in flight for --duration seconds.
+"""
+
+import argparse
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import requests  # noqa: E402
+from flask import Flask  # noqa: E402
+from flask.sessions import SecureCookieSessionInterface  # noqa: E402
+
+from blueprints.authentication import scope  # noqa: E402
+from fake_spotify import FakeSpotifyServer  # noqa: E402
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+SECRET_KEY = 'benchmark'
+
+
+def session_cookie():
+    # What the app would set after login: a valid token and a cached profile
+    app = Flask(__name__)
+    app.secret_key = SECRET_KEY
+    now = time.time()
+    return SecureCookieSessionInterface().get_signing_serializer(app).dumps({
+        'token_info': {'access_token': 'token-user00001', 'refresh_token': 'refresh-user00001',
+                       'token_type': 'Bearer', 'expires_in': 3600, 'expires_at': int(now) + 3600,
+                       'scope': ' '.join(scope)},
+        'profile': {'id': 'user00001', 'display_name': 'User user00001', 'followers_count': 0,
+                    'external_url': None, 'country': 'US', 'email': None, 'product': 'premium',
+                    'fetched_at': now},
+    })
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_gunicorn(mode, port, api_url, threads):
+    env = dict(os.environ, WORKER_MODE=mode, WEB_CONCURRENCY='1', GUNICORN_THREADS=str(threads), PORT=str(port),
+               SPOTIFY_API_URL=api_url, STORAGE_BACKEND='memory', SNAPSHOT_SCHEDULER='0',
+               FLASK_SECRET_KEY=SECRET_KEY, SPOTIPY_CLIENT_ID='benchmark', SPOTIPY_CLIENT_SECRET='benchmark',
+               SPOTIPY_REDIRECT_URI='http://127.0.0.1:8080')
+    process = subprocess.Popen([sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', '--log-level', 'warning',
+                                'main:app'], cwd=ROOT, env=env)
+    for _ in range(100):
+        try:
+            requests.get(f'http://127.0.0.1:{port}/', timeout=1)
+            return process
+        except requests.ConnectionError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError(f'gunicorn ({mode}) did not start')
+
+
+def drive(url, cookie, clients, duration):
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def client():
+        http = requests.Session()
+        http.cookies.set('session', cookie)
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            try:
+                ok = http.get(url, timeout=30, allow_redirects=False).status_code == 200
+            except requests.RequestException:
+                ok = False
+            with lock:
+                latencies.append(time.perf_counter() - start)
+                errors[0] += not ok
+
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return {
+        'rps': len(latencies) / elapsed,
+        'p50_ms': latencies[len(latencies) // 2] * 1000,
+        'p99_ms': latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000,
+        'errors': errors[0],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--latency', type=float, default=0.1, help='seconds per Spotify round trip')
+    parser.add_argument('--clients', type=int, default=200, help='requests kept in flight')
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--threads', type=int, default=8, help='GUNICORN_THREADS for the sync mode')
+    args = parser.parse_args()
+
+    spotify = FakeSpotifyServer(latency=args.latency, playlists=20).start()
+    cookie = session_cookie()
+
+    print(f'{"mode":<8} {"req/s":>8} {"p50 ms":>8} {"p99 ms":>8} {"errors":>7}')
+    for mode in ('sync', 'gevent'):
+        port = free_port()
+        process = start_gunicorn(mode, port, spotify.prefix, args.threads)
+        try:
+            stats = drive(f'http://127.0.0.1:{port}/playlists', cookie, args.clients, args.duration)
+        finally:
+            process.terminate()
+            process.wait()
+        print(f'{mode:<8} {stats["rps"]:>8.1f} {stats["p50_ms"]:>8.1f} {stats["p99_ms"]:>8.1f} {stats["errors"]:>7}')
+
+
+if __name__ == '__main__':
+    main()
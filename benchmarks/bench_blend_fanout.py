@@ -0,0 +1,61 @@
+"""
+Compare sequential vs. fetch_engine fan-out of artist top tracks, the
+upstream part of building a blend in /create_playlist.
+
+    python benchmarks/bench_blend_fanout.py [--latency 0.05] [--runs 20]
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import time
+
+import spotipy
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from fetch_engine import fetch_all  # noqa: E402
+from fake_spotify import FakeSpotifyServer  # noqa: E402
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def sequential(spotify, artist_ids):
+    return [spotify.artist_top_tracks(artist_id) for artist_id in artist_ids]
+
+
+def concurrent(spotify, artist_ids):
+    return fetch_all(spotify, lambda client, artist_id: client.artist_top_tracks(artist_id), artist_ids)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--latency', type=float, default=0.05)
+    parser.add_argument('--runs', type=int, default=20)
+    args = parser.parse_args()
+
+    server = FakeSpotifyServer(latency=args.latency).start()
+    spotify = spotipy.Spotify(auth='benchmark-token')
+    spotify.prefix = server.prefix
+
+    print(f'upstream latency {args.latency * 1000:.0f}ms, {args.runs} runs each')
+    print(f'{"artists":>8} {"mode":>11} {"p50 ms":>8} {"p95 ms":>8}')
+    for n_artists in (5, 15, 50):
+        artist_ids = [f'artist{n:04d}' for n in range(n_artists)]
+        for name, fn in (('sequential', sequential), ('fan-out', concurrent)):
+            samples = []
+            for _ in range(args.runs):
+                start = time.perf_counter()
+                fn(spotify, artist_ids)
+                samples.append((time.perf_counter() - start) * 1000)
+            print(f'{n_artists:>8} {name:>11} {statistics.median(samples):>8.1f} {percentile(samples, 95):>8.1f}')
+
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+"""
+Size and read cost of a favorites document: version 2 (a list of entry
+dicts per range) vs. version 3 (columnar), plain and zlib-compressed.
+
+    python benchmarks/bench_favorites_format.py [--entries 50] [--reads 2000]
+
+Sizes are of the JSON (or JSON plus compressed bytes) a backend stores.
+Reads decode to TrackEntry / ArtistEntry objects whatever the version; the
+last lines compare one of those with the dict entries reads used to return.
+"""
+
+import argparse
+import json
+import os
+import random
+import string
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import favorites  # noqa: E402
+from favorites import ID_FIELDS, IMAGE_URL_PREFIX, RANGES, range_hash, read_favorites  # noqa: E402
+
+
+def spotify_id(rng):
+    return ''.join(rng.choices(string.ascii_letters + string.digits, k=22))
+
+
+def sample_ranges(kind, entries, rng):
+    # Ranges overlap the way real top items do
+    pool = [spotify_id(rng) for _ in range(entries * 2)]
+    ranges = {}
+    for sp_range in RANGES:
+        ids = rng.sample(pool, entries)
+        if kind == 'tracks':
+            ranges[sp_range] = [{
+                'name': f'Track {track_id[:6]}',
+                'artist': f'Artist {track_id[6:10]}',
+                'album': f'Album {track_id[10:16]}',
+                'track_id': track_id,
+                'external_url': f'https://open.spotify.com/track/{track_id}',
+                'image_url': IMAGE_URL_PREFIX + 'ab67616d0000b273' + spotify_id(rng)[:24],
+            } for track_id in ids]
+        else:
+            ranges[sp_range] = [{
+                'name': f'Artist {artist_id[:8]}',
+                'popularity': rng.randint(0, 100),
+                'external_url': f'https://open.spotify.com/artist/{artist_id}',
+                'id': artist_id,
+            } for artist_id in ids]
+    return ranges
+
+
+def v2_document(kind, ranges):
+    # Version 2 also stored the de-duplicated IDs, which nothing read
+    id_field = ID_FIELDS[kind]
+    return {
+        'version': 2,
+        'ranges': ranges,
+        'ids': list(dict.fromkeys(entry[id_field] for sp_range in RANGES for entry in ranges[sp_range])),
+        'hashes': {sp_range: range_hash(ranges[sp_range]) for sp_range in RANGES},
+    }
+
+
+def stored_size(document):
+    # Compressed ranges are bytes, which every backend stores as-is
+    ranges = document['ranges']
+    binary = sum(len(value) for value in ranges.values() if isinstance(value, bytes))
+    rest = dict(document, ranges={k: v for k, v in ranges.items() if not isinstance(v, bytes)})
+    return len(json.dumps(rest, separators=(',', ':')).encode()) + binary
+
+
+def read_time(kind, document, reads):
+    start = time.perf_counter()
+    for _ in range(reads):
+        read_favorites(kind, document)
+    return (time.perf_counter() - start) / reads * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--entries', type=int, default=50, help='entries per range')
+    parser.add_argument('--reads', type=int, default=2000)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    entry_sizes = {}
+    print(f'{args.entries} entries per range, {len(RANGES)} ranges')
+    print(f'{"kind":>8} {"format":>10} {"bytes":>8} {"read µs":>9}')
+    for kind in ('tracks', 'artists'):
+        ranges = sample_ranges(kind, args.entries, rng)
+        documents = [('v2', v2_document(kind, ranges))]
+        for name, compression in (('v3', ''), ('v3 zlib', 'zlib')):
+            favorites.COMPRESSION = compression
+            documents.append((name, favorites.favorites_document(kind, ranges)))
+
+        for name, document in documents:
+            print(f'{kind:>8} {name:>10} {stored_size(document):>8} {read_time(kind, document, args.reads):>9.1f}')
+        entry = read_favorites(kind, documents[-1][1])['ranges'][RANGES[0]][0]
+        entry_sizes[kind] = (sys.getsizeof(ranges[RANGES[0]][0]), sys.getsizeof(entry), type(entry).__name__)
+
+    for kind, (as_dict, as_entry, entry_class) in entry_sizes.items():
+        print(f'one {kind[:-1]} entry: {as_dict} bytes as a dict, {as_entry} as {entry_class}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+"""
+Round trips and wall time for listing users on /find_users: the original
+per-user reads vs. the user_summaries query, against the in-memory
+Firestore fake.
+
+    python benchmarks/bench_find_users.py [--latency 0.002]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from favorites import RANGES, partition_by_range, summary_document  # noqa: E402
+from storage.firestore_store import FirestoreStore  # noqa: E402
+from fake_firestore import FakeFirestore  # noqa: E402
+
+
+class FakeSpotify:
+    def __init__(self, latency):
+        self.latency = latency
+        self.calls = 0
+
+    def user(self, user_id):
+        self.calls += 1
+        time.sleep(self.latency)
+        return {'id': user_id, 'display_name': f'User {user_id}'}
+
+
+def populate(db, n_users, per_range=50):
+    for u in range(n_users):
+        user_id = f'user{u:05d}'
+        # Stored in the original flat format, which the legacy loop expects
+        artists = [{'name': f'Artist {n}', 'range': sp_range, 'popularity': 50, 'id': f'artist{n}',
+                    'external_url': f'https://open.spotify.com/artist/artist{n}'}
+                   for sp_range in RANGES for n in range(per_range)]
+        tracks = [{'name': f'Track {n}', 'artist': f'Artist {n}', 'range': sp_range, 'album': 'Album',
+                   'track_id': f'track{n}', 'external_url': f'https://open.spotify.com/track/track{n}',
+                   'image_url': 'https://i.scdn.co/image/x'}
+                  for sp_range in RANGES for n in range(per_range)]
+        favorites = db.collection('users').document(user_id).collection('user_favorites')
+        favorites.document('top_artists').set({'artists': artists})
+        favorites.document('top_tracks').set({'tracks': tracks})
+        summary = summary_document(user_id, f'User {user_id}', 'artists', partition_by_range(artists))
+        summary.update(summary_document(user_id, f'User {user_id}', 'tracks', partition_by_range(tracks)))
+        db.collection('user_summaries').document(user_id).set(summary)
+
+
+def legacy_find_users(db, spotify):
+    # The loop /find_users used before user_summaries existed.
+    def divide_by_range(items):
+        return tuple([item for item in items if item['range'] == r][:5] for r in RANGES)
+
+    seen_user_ids = set()
+    users = []
+    for user_favorite_doc in db.collection_group('user_favorites').stream():
+        user_id = user_favorite_doc.reference.parent.parent.id
+        if user_id in seen_user_ids:
+            continue
+        seen_user_ids.add(user_id)
+        top_artists_doc = db.document(f'users/{user_id}/user_favorites/top_artists').get()
+        top_artists = (top_artists_doc.to_dict() if top_artists_doc.exists else {}).get('artists', [])
+        top_tracks_doc = db.document(f'users/{user_id}/user_favorites/top_tracks').get()
+        top_tracks = (top_tracks_doc.to_dict() if top_tracks_doc.exists else {}).get('tracks', [])
+        users.append({
+            'user_id': user_id,
+            'display_name': spotify.user(user_id)['display_name'],
+            'artists': dict(zip(RANGES, divide_by_range(top_artists))),
+            'tracks': dict(zip(RANGES, divide_by_range(top_tracks))),
+        })
+    return users
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--latency', type=float, default=0.002, help='seconds per Firestore round trip')
+    parser.add_argument('--spotify-latency', type=float, default=0.05, help='seconds per spotify.user call')
+    args = parser.parse_args()
+
+    print(f'{"users":>6} {"mode":>10} {"firestore":>10} {"spotify":>8} {"ms":>9}')
+    for n_users in (10, 100, 1000):
+        db = FakeFirestore()
+        populate(db, n_users)
+        db.latency = args.latency
+        for name in ('legacy', 'summaries'):
+            spotify = FakeSpotify(args.spotify_latency)
+            db.round_trips = 0
+            start = time.perf_counter()
+            users = legacy_find_users(db, spotify) if name == 'legacy' else list(FirestoreStore(db).iter_summaries())
+            elapsed = (time.perf_counter() - start) * 1000
+            assert len(users) == n_users
+            print(f'{n_users:>6} {name:>10} {db.round_trips:>10} {spotify.calls:>8} {elapsed:>9.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+"""
+Time to load a group's favorites (one batched read) and build a group
+blend, against the in-memory Firestore fake.
+
+    python benchmarks/bench_group_blend.py [--latency 0.02] [--runs 20]
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from blend import build_blend  # noqa: E402
+from favorites import RANGES, favorites_document  # noqa: E402
+from storage.firestore_store import FirestoreStore  # noqa: E402
+from fake_firestore import FakeFirestore  # noqa: E402
+
+
+def populate(db, n_users, per_range=50, catalog=2000):
+    # Users draw from a shared catalog so there is overlap to dedup
+    for u in range(n_users):
+        user_id = f'user{u:05d}'
+        ranges = {
+            sp_range: [{'name': f'Track {t}', 'artist': f'Artist {t % 500}', 'album': 'Album',
+                        'track_id': f'track{t}', 'external_url': f'https://open.spotify.com/track/track{t}',
+                        'image_url': None}
+                       for t in ((u * 37 + r * 101 + n * 7) % catalog for n in range(per_range))]
+            for r, sp_range in enumerate(RANGES)
+        }
+        FirestoreStore(db).favorites_ref(user_id, 'tracks').set(favorites_document('tracks', ranges))
+    return [f'user{u:05d}' for u in range(n_users)]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--latency', type=float, default=0.02, help='seconds per Firestore round trip')
+    parser.add_argument('--runs', type=int, default=20)
+    args = parser.parse_args()
+
+    print(f'{"users":>6} {"round trips":>12} {"p50 ms":>8} {"max ms":>8} {"tracks":>7}')
+    for n_users in (5, 20, 50, 100):
+        db = FakeFirestore()
+        user_ids = populate(db, n_users)
+        db.latency = args.latency
+        samples = []
+        for _ in range(args.runs):
+            db.round_trips = 0
+            start = time.perf_counter()
+            tracks = build_blend(FirestoreStore(db).get_group_favorites(user_ids))
+            samples.append((time.perf_counter() - start) * 1000)
+        print(f'{n_users:>6} {db.round_trips:>12} {statistics.median(samples):>8.1f} {max(samples):>8.1f} '
+              f'{len(tracks):>7}')
+
+
+if __name__ == '__main__':
+    main()
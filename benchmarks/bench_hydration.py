@@ -0,0 +1,59 @@
+"""
+Spotify calls and wall time to look up artist metadata for the artists on
+a page of /find_users: one spotify.artist() per ID (fanned out) vs.
+hydration's bulk lookups, cold and with the cache warm. The per-ID calls
+run at most fetch_engine.PER_USER_CONCURRENCY at a time, as they would in
+the app.
+
+    python benchmarks/bench_hydration.py [--latency 0.05]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import spotipy
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from cache import CACHE_MAX_BYTES, MemoryBackend, cache  # noqa: E402
+from fetch_engine import fetch_all  # noqa: E402
+from fake_spotify import FakeSpotifyServer  # noqa: E402
+from hydration import hydrate  # noqa: E402
+
+
+def per_id(spotify, artist_ids):
+    return fetch_all(spotify, lambda client, artist_id: client.artist(artist_id), artist_ids)
+
+
+def bulk(spotify, artist_ids):
+    return hydrate(spotify, 'artists', artist_ids)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--latency', type=float, default=0.05)
+    args = parser.parse_args()
+
+    server = FakeSpotifyServer(latency=args.latency).start()
+    spotify = spotipy.Spotify(auth='benchmark-token')
+    spotify.prefix = server.prefix
+
+    print(f'upstream latency {args.latency * 1000:.0f}ms')
+    print(f'{"artists":>8} {"mode":>12} {"calls":>6} {"ms":>8}')
+    for n_artists in (15, 150, 750):
+        artist_ids = [f'artist{n:04d}' for n in range(n_artists)]
+        cache.backend = MemoryBackend(CACHE_MAX_BYTES)  # start cold
+        for name, fn in (('per-id', per_id), ('bulk cold', bulk), ('bulk warm', bulk)):
+            server.calls.clear()
+            start = time.perf_counter()
+            fn(spotify, artist_ids)
+            elapsed = (time.perf_counter() - start) * 1000
+            print(f'{n_artists:>8} {name:>12} {sum(server.calls.values()):>6} {elapsed:>8.1f}')
+
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
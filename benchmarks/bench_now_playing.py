@@ -0,0 +1,138 @@
+"""
+Spotify calls for watching /currently_playing in several tabs: reloading
+the page the way it worked before the live stream (a currently playing
+call plus a cached top tracks lookup per view) vs. the shared poller and
+the /currently_playing/next long-poll.
+
+    python benchmarks/bench_now_playing.py [--tabs 5] [--duration 20] [--reload-every 2] [--track-seconds 5]
+        [--max-waiters N]
+
+The fake Spotify API switches tracks every --track-seconds. Tabs past
+--max-waiters (the app's NOW_PLAYING_MAX_WAITERS) fall back to polling.
+"""
+
+import argparse
+import logging
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+os.environ.setdefault('SPOTIPY_REDIRECT_URI', 'http://127.0.0.1:8080')
+os.environ.setdefault('FLASK_SECRET_KEY', 'benchmark')
+os.environ.setdefault('SPOTIPY_CLIENT_ID', 'benchmark')
+os.environ.setdefault('SPOTIPY_CLIENT_SECRET', 'benchmark')
+os.environ.setdefault('SNAPSHOT_SCHEDULER', '0')
+os.environ.setdefault('STORAGE_BACKEND', 'memory')
+
+import requests  # noqa: E402
+
+from fake_spotify import FakeSpotifyServer  # noqa: E402
+
+NOW_PLAYING_CALLS = ('/v1/me/player/currently-playing', '/v1/artists/{id}/top-tracks')
+
+
+def legacy_views(spotify, tabs, duration, reload_every):
+    # What every reload of the old page did
+    from cache import cached_artist_top_tracks
+
+    def tab():
+        deadline = time.monotonic() + duration
+        while time.monotonic() < deadline:
+            track = spotify.current_user_playing_track()
+            if track:
+                cached_artist_top_tracks(spotify, track['item']['artists'][0]['id'], country='US')
+            time.sleep(reload_every)
+
+    run_tabs(tab, tabs)
+
+
+def long_polled(base_url, cookies, tabs, duration):
+    updates = []
+    requests_made = []
+
+    def tab():
+        http = requests.Session()
+        http.cookies.update(cookies)
+        deadline = time.monotonic() + duration
+        version = -1
+        while time.monotonic() < deadline:
+            try:
+                response = http.get(f'{base_url}/currently_playing/next', params={'after': version},
+                                    timeout=max(deadline - time.monotonic(), 0.1))
+            except requests.Timeout:
+                break
+            requests_made.append(1)
+            data = response.json()
+            if data['version'] != version:
+                version = data['version']
+                updates.append(1)
+            time.sleep(min(data['retry_in'], max(deadline - time.monotonic(), 0)))
+
+    run_tabs(tab, tabs)
+    return len(updates), len(requests_made)
+
+
+def run_tabs(tab, tabs):
+    threads = [threading.Thread(target=tab) for _ in range(tabs)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--tabs', type=int, default=5)
+    parser.add_argument('--duration', type=float, default=20)
+    parser.add_argument('--reload-every', type=float, default=2, help='seconds between reloads of the old page')
+    parser.add_argument('--track-seconds', type=float, default=5)
+    parser.add_argument('--max-waiters', type=int, help='long-polls a worker holds open at once')
+    args = parser.parse_args()
+    if args.max_waiters is not None:
+        os.environ['NOW_PLAYING_MAX_WAITERS'] = str(args.max_waiters)
+
+    server = FakeSpotifyServer(latency=0.02, track_seconds=args.track_seconds).start()
+    os.environ['SPOTIFY_API_URL'] = server.prefix
+
+    import spotipy
+    from werkzeug.serving import make_server
+    import main as app_main
+    from spotify_client import SpotifyClient
+
+    spotipy.oauth2.SpotifyOAuth.OAUTH_TOKEN_URL = server.token_url
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    http_server = make_server('127.0.0.1', 0, app_main.app, threaded=True)
+    threading.Thread(target=http_server.serve_forever, daemon=True).start()
+    base_url = f'http://127.0.0.1:{http_server.server_port}'
+
+    login = requests.Session()
+    stdout, sys.stdout = sys.stdout, open(os.devnull, 'w')  # the callback prints tokens
+    try:
+        login.get(f'{base_url}/auth/callback?code=user00001', allow_redirects=False)
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+
+    track_changes = int(args.duration // args.track_seconds)
+    print(f'{args.tabs} tabs for {args.duration:.0f}s, a new track every {args.track_seconds:.0f}s '
+          f'(~{track_changes} changes)')
+    print(f'{"mode":>10} {"updates":>8} {"requests":>9} {"spotify calls":>14}')
+
+    server.calls.clear()
+    legacy_views(SpotifyClient(auth='token-user00001'), args.tabs, args.duration, args.reload_every)
+    views = args.tabs * int(args.duration // args.reload_every)
+    print(f'{"reload":>10} {views:>8} {views:>9} {sum(server.calls.get(call, 0) for call in NOW_PLAYING_CALLS):>14}')
+
+    server.calls.clear()
+    updates, requests_made = long_polled(base_url, login.cookies, args.tabs, args.duration)
+    print(f'{"long-poll":>10} {updates:>8} {requests_made:>9} '
+          f'{sum(server.calls.get(call, 0) for call in NOW_PLAYING_CALLS):>14}')
+
+    http_server.shutdown()
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
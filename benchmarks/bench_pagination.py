@@ -0,0 +1,65 @@
+"""
+Walking a large playlist library: following `next` one page at a time vs.
+pagination.iter_items with pages prefetched, and what stopping early
+costs.
+
+    python benchmarks/bench_pagination.py [--latency 0.05] [--playlists 1000]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import spotipy
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from fake_spotify import FakeSpotifyServer  # noqa: E402
+from pagination import PAGE_SIZE, iter_items  # noqa: E402
+
+
+def sequential(spotify, stop_at=None):
+    page = spotify.current_user_playlists(limit=PAGE_SIZE)
+    while page:
+        for playlist in page['items']:
+            if playlist['name'] == stop_at:
+                return
+        page = spotify.next(page) if page['next'] else None
+
+
+def paginated(prefetch):
+    def walk(spotify, stop_at=None):
+        for playlist in iter_items(spotify, spotify.current_user_playlists(limit=PAGE_SIZE), prefetch=prefetch):
+            if playlist['name'] == stop_at:
+                return
+    return walk
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--latency', type=float, default=0.05)
+    parser.add_argument('--playlists', type=int, default=1000)
+    args = parser.parse_args()
+
+    server = FakeSpotifyServer(latency=args.latency, playlists=args.playlists).start()
+    spotify = spotipy.Spotify(auth='benchmark-token')
+    spotify.prefix = server.prefix
+
+    print(f'{args.playlists} playlists, upstream latency {args.latency * 1000:.0f}ms')
+    print(f'{"walk":>12} {"mode":>12} {"calls":>6} {"ms":>8}')
+    modes = (('sequential', sequential), ('prefetch=1', paginated(1)), ('prefetch=4', paginated(4)))
+    for walk, stop_at in (('full', None), ('stop early', 'Playlist 10')):
+        for name, fn in modes:
+            server.calls.clear()
+            start = time.perf_counter()
+            fn(spotify, stop_at)
+            elapsed = (time.perf_counter() - start) * 1000
+            time.sleep(args.latency + 0.5)  # prefetches sent before we stopped land late
+            print(f'{walk:>12} {name:>12} {sum(server.calls.values()):>6} {elapsed:>8.1f}')
+
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
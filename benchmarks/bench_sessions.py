@@ -0,0 +1,81 @@
+"""
+Requests/sec for one worker serving an authenticated page under each
+session backend. The token and cached profile are valid, so the page makes
+no upstream calls and the difference is session handling.
+
+    python benchmarks/bench_sessions.py [--requests 2000]
+
+The redis backend runs against fakeredis when it is installed.
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+os.environ.setdefault('SPOTIPY_REDIRECT_URI', 'http://127.0.0.1:8080')
+os.environ.setdefault('FLASK_SECRET_KEY', 'benchmark')
+os.environ.setdefault('SPOTIPY_CLIENT_ID', 'benchmark')
+os.environ.setdefault('SPOTIPY_CLIENT_SECRET', 'benchmark')
+os.environ.setdefault('STORAGE_BACKEND', 'memory')
+
+import main  # noqa: E402
+from blueprints.authentication import scope  # noqa: E402
+from sessions import configure_sessions  # noqa: E402
+
+
+def login(client):
+    now = time.time()
+    with client.session_transaction() as session:
+        session['token_info'] = {
+            'access_token': 'benchmark-token', 'refresh_token': 'benchmark-refresh',
+            'token_type': 'Bearer', 'expires_in': 3600, 'expires_at': int(now) + 3600,
+            'scope': ' '.join(scope),
+        }
+        session['profile'] = {
+            'id': 'benchmark-user', 'display_name': 'Benchmark', 'followers_count': 0,
+            'external_url': None, 'country': 'US', 'email': None, 'product': 'premium',
+            'fetched_at': now,
+        }
+
+
+def run(backend, n_requests, refresh_each_request=False):
+    app = main.app
+    redis_client = None
+    if backend == 'redis':
+        try:
+            import fakeredis
+        except ImportError:
+            return None
+        redis_client = fakeredis.FakeRedis()
+    configure_sessions(app, backend, redis_client=redis_client)
+    app.config['SESSION_REFRESH_EACH_REQUEST'] = refresh_each_request
+
+    with app.test_client() as client:
+        login(client)
+        assert client.get('/current_user').status_code == 200
+        start = time.perf_counter()
+        for _ in range(n_requests):
+            client.get('/current_user')
+        return n_requests / (time.perf_counter() - start)
+
+
+def main_():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=2000)
+    args = parser.parse_args()
+
+    rows = [
+        ('filesystem, refresh every request (before)', 'filesystem', True),
+        ('filesystem', 'filesystem', False),
+        ('cookie', 'cookie', False),
+        ('redis', 'redis', False),
+    ]
+    for label, backend, refresh in rows:
+        rate = run(backend, args.requests, refresh)
+        print(f'{label:<44} ' + (f'{rate:8.0f} req/s' if rate else 'skipped (fakeredis not installed)'))
+
+
+if __name__ == '__main__':
+    main_()
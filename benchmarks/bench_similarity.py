@@ -0,0 +1,84 @@
+"""
+Most similar listeners for every user: a pure Python pairwise comparison
+vs. similarity.py's blocked sparse product, plus what one save costs
+incrementally. Favorites are synthetic, with overlapping tastes.
+
+    python benchmarks/bench_similarity.py [--users 1000 5000]
+"""
+
+import argparse
+import heapq
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from favorites import RANGES  # noqa: E402
+from similarity import NEIGHBORS, SimilarityIndex, taste_vector  # noqa: E402
+from storage.memory_store import MemoryStore  # noqa: E402
+
+
+def synthetic_favorites(rng, per_range=50):
+    base = rng.randrange(5000)
+    artists = {sp_range: [{'id': f'artist{(base + rng.randrange(300)) % 5000}', 'name': '', 'popularity': 0,
+                           'external_url': ''} for _ in range(per_range)] for sp_range in RANGES}
+    tracks = {sp_range: [{'track_id': f'track{(base * 3 + rng.randrange(900)) % 15000}', 'name': '', 'artist': '',
+                          'album': '', 'external_url': '', 'image_url': None} for _ in range(per_range)]
+              for sp_range in RANGES}
+    return {'artists': {'ranges': artists}, 'tracks': {'ranges': tracks}}
+
+
+def pairwise(vectors):
+    # The naive version: compare every pair of users' dicts
+    neighbors = {}
+    for user_id, vector in vectors.items():
+        scores = []
+        for other, other_vector in vectors.items():
+            if other != user_id:
+                score = sum(weight * other_vector.get(feature, 0.0) for feature, weight in vector.items())
+                if score > 0:
+                    scores.append((score, other))
+        neighbors[user_id] = heapq.nlargest(NEIGHBORS, scores)
+    return neighbors
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, nargs='+', default=[1000, 5000])
+    parser.add_argument('--pairwise-max', type=int, default=2000, help='skip the pairwise run above this many users')
+    args = parser.parse_args()
+
+    print(f'{"users":>6} {"mode":>12} {"ms":>10}')
+    for n_users in args.users:
+        rng = random.Random(n_users)
+        favorites = {f'user{n:05d}': synthetic_favorites(rng) for n in range(n_users)}
+        vectors = {user_id: taste_vector(user_favorites) for user_id, user_favorites in favorites.items()}
+
+        if n_users <= args.pairwise_max:
+            start = time.perf_counter()
+            pairwise(vectors)
+            print(f'{n_users:>6} {"pairwise":>12} {(time.perf_counter() - start) * 1000:>10.1f}')
+
+        index = SimilarityIndex()
+        start = time.perf_counter()
+        for user_id, vector in vectors.items():
+            index._set_vector(user_id, user_id, vector)
+        index.neighbors = index._compute_neighbors(list(range(n_users)))
+        index.built_at = time.time()
+        print(f'{n_users:>6} {"matrix":>12} {(time.perf_counter() - start) * 1000:>10.1f}')
+
+        # One user saves new favorites; the store is only there to hand them over
+        store = MemoryStore()
+        user_id = 'user00000'
+        new_favorites = synthetic_favorites(rng)
+        for kind in ('artists', 'tracks'):
+            store.save_favorites(user_id, user_id, kind, new_favorites[kind]['ranges'])
+        start = time.perf_counter()
+        index.update(store, user_id, user_id)
+        print(f'{n_users:>6} {"incremental":>12} {(time.perf_counter() - start) * 1000:>10.1f}')
+
+
+if __name__ == '__main__':
+    main()
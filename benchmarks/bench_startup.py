@@ -0,0 +1,97 @@
+"""
+Cold-start cost: how long a fresh interpreter takes to import the app and
+serve its first requests. Each run is a new process, so nothing is warm.
+
+    python benchmarks/bench_startup.py [--runs 10] [--max-import-ms 400]
+
+Reports the median of
+    import        `import main`
+    first /       a logged out request
+    first login   a logged in page (valid token and cached profile in the
+                  session, so no upstream calls; this is where spotipy gets
+                  imported)
+and which heavy modules were already loaded right after the import. With
+--max-import-ms the script exits non-zero when the median import time is
+over budget, so CI can catch cold-start regressions.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+HEAVY_MODULES = ['spotipy', 'requests', 'redis', 'flask_session', 'google.cloud.firestore']
+
+CHILD = '''
+import json, sys, time
+start = time.perf_counter()
+import main
+imported = time.perf_counter()
+from blueprints.authentication import scope
+loaded = [name for name in HEAVY_MODULES if name in sys.modules]
+
+client = main.app.test_client()
+assert client.get('/').status_code == 200
+first_anonymous = time.perf_counter()
+
+now = time.time()
+with client.session_transaction() as session:
+    session['token_info'] = {
+        'access_token': 'benchmark-token', 'refresh_token': 'benchmark-refresh',
+        'token_type': 'Bearer', 'expires_in': 3600, 'expires_at': int(now) + 3600,
+        'scope': ' '.join(scope),
+    }
+    session['profile'] = {
+        'id': 'benchmark-user', 'display_name': 'Benchmark', 'followers_count': 0,
+        'external_url': None, 'country': 'US', 'email': None, 'product': 'premium',
+        'fetched_at': now,
+    }
+login_start = time.perf_counter()
+assert client.get('/current_user').status_code == 200
+first_login = time.perf_counter()
+
+print(json.dumps({
+    'import': imported - start,
+    'first /': first_anonymous - imported,
+    'first login': first_login - login_start,
+    'loaded': loaded,
+}))
+'''
+
+
+def run_once():
+    env = dict(os.environ)
+    env.setdefault('SPOTIPY_REDIRECT_URI', 'http://127.0.0.1:8080')
+    env.setdefault('FLASK_SECRET_KEY', 'benchmark')
+    env.setdefault('SPOTIPY_CLIENT_ID', 'benchmark')
+    env.setdefault('SPOTIPY_CLIENT_SECRET', 'benchmark')
+    env.setdefault('STORAGE_BACKEND', 'memory')
+    env.setdefault('SNAPSHOT_SCHEDULER', '0')
+    code = f'HEAVY_MODULES = {HEAVY_MODULES!r}\n' + CHILD
+    result = subprocess.run([sys.executable, '-c', code], cwd=ROOT, env=env, capture_output=True, text=True,
+                            check=True)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main_():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--max-import-ms', type=float, default=None)
+    args = parser.parse_args()
+
+    runs = [run_once() for _ in range(args.runs)]
+    for phase in ('import', 'first /', 'first login'):
+        print(f'{phase:<12} {statistics.median(run[phase] for run in runs) * 1000:8.1f} ms (median of {args.runs})')
+    print(f'heavy modules loaded at import: {", ".join(runs[0]["loaded"]) or "none"}')
+
+    import_ms = statistics.median(run['import'] for run in runs) * 1000
+    if args.max_import_ms is not None and import_ms > args.max_import_ms:
+        print(f'import took {import_ms:.1f} ms, over the {args.max_import_ms:.0f} ms budget')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main_()
@@ -0,0 +1,214 @@
+"""
+An in-memory stand-in for google.cloud.firestore.Client, good enough for
+benchmarks.
+
+It implements the subset of the API the app uses, counts round trips and
+sleeps `latency` seconds per round trip, so algorithms can be compared by
+how many times they go to the database.
+"""
+
+import copy
+import threading
+import time
+
+
+class FakeSnapshot:
+    def __init__(self, reference, data):
+        self.reference = reference
+        self.id = reference.id
+        self._data = data
+
+    @property
+    def exists(self):
+        return self._data is not None
+
+    def to_dict(self):
+        return copy.deepcopy(self._data) if self._data is not None else None
+
+    def get(self, field):
+        value = self._data
+        for part in field.split('.'):
+            value = value[part]
+        return copy.deepcopy(value)
+
+
+class FakeQuery:
+    def __init__(self, client, matches, filters=(), order=None, limit=None, start_after=None):
+        self._client = client
+        self._matches = matches
+        self._filters = list(filters)
+        self._order = order
+        self._limit = limit
+        self._start_after = start_after
+
+    def _copy(self, **changes):
+        state = dict(filters=self._filters, order=self._order, limit=self._limit, start_after=self._start_after)
+        state.update(changes)
+        return FakeQuery(self._client, self._matches, **state)
+
+    def where(self, field, op, value):
+        assert op in ('==', 'in'), op
+        return self._copy(filters=self._filters + [(field, op, value)])
+
+    def order_by(self, field):
+        return self._copy(order=field)
+
+    def limit(self, count):
+        return self._copy(limit=count)
+
+    def start_after(self, values):
+        if isinstance(values, FakeSnapshot):
+            values = values.to_dict()
+        return self._copy(start_after=values[self._order])
+
+    def stream(self):
+        self._client._round_trip()
+        with self._client._lock:
+            docs = [(path, data) for path, data in self._client._docs.items() if self._matches(path)]
+        for field, op, value in self._filters:
+            if op == '==':
+                docs = [(path, data) for path, data in docs if data.get(field) == value]
+            else:
+                docs = [(path, data) for path, data in docs if data.get(field) in value]
+        if self._order:
+            docs.sort(key=lambda doc: doc[1].get(self._order))
+            if self._start_after is not None:
+                docs = [doc for doc in docs if doc[1].get(self._order) > self._start_after]
+        else:
+            docs.sort()
+        if self._limit is not None:
+            docs = docs[:self._limit]
+        for path, data in docs:
+            yield FakeSnapshot(self._client.document(path), copy.deepcopy(data))
+
+    def get(self):
+        return list(self.stream())
+
+
+class FakeCollectionReference(FakeQuery):
+    def __init__(self, client, path):
+        self.path = path
+        self.id = path.rsplit('/', 1)[-1]
+        prefix = path + '/'
+        super().__init__(client, lambda doc_path: doc_path.startswith(prefix) and '/' not in doc_path[len(prefix):])
+
+    @property
+    def parent(self):
+        if '/' not in self.path:
+            return None
+        return self._client.document(self.path.rsplit('/', 1)[0])
+
+    def document(self, document_id):
+        return self._client.document(f'{self.path}/{document_id}')
+
+
+class FakeDocumentReference:
+    def __init__(self, client, path):
+        self._client = client
+        self.path = path
+        self.id = path.rsplit('/', 1)[-1]
+
+    @property
+    def parent(self):
+        return self._client.collection(self.path.rsplit('/', 1)[0])
+
+    def collection(self, collection_id):
+        return self._client.collection(f'{self.path}/{collection_id}')
+
+    def get(self, field_paths=None):
+        self._client._round_trip()
+        with self._client._lock:
+            data = copy.deepcopy(self._client._docs.get(self.path))
+        if data is not None and field_paths is not None:
+            data = {field: data[field] for field in field_paths if field in data}
+        return FakeSnapshot(self, data)
+
+    def set(self, data, merge=False):
+        self._client._round_trip()
+        with self._client._lock:
+            if merge and self.path in self._client._docs:
+                self._client._merge(self._client._docs[self.path], data)
+            else:
+                self._client._docs[self.path] = copy.deepcopy(data)
+
+    def update(self, changes):
+        self._client._round_trip()
+        with self._client._lock:
+            self._client._apply_update(self.path, changes)
+
+    def delete(self):
+        self._client._round_trip()
+        with self._client._lock:
+            self._client._docs.pop(self.path, None)
+
+
+class FakeWriteBatch:
+    def __init__(self, client):
+        self._client = client
+        self._writes = []
+
+    def set(self, reference, data, merge=False):
+        self._writes.append(('set', reference, data, merge))
+
+    def update(self, reference, changes):
+        self._writes.append(('update', reference, changes, None))
+
+    def commit(self):
+        self._client._round_trip()
+        with self._client._lock:
+            for op, reference, data, merge in self._writes:
+                if op == 'update':
+                    self._client._apply_update(reference.path, data)
+                elif merge and reference.path in self._client._docs:
+                    self._client._merge(self._client._docs[reference.path], data)
+                else:
+                    self._client._docs[reference.path] = copy.deepcopy(data)
+
+
+class FakeFirestore:
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.round_trips = 0
+        self._docs = {}
+        self._lock = threading.Lock()
+
+    def _round_trip(self):
+        with self._lock:
+            self.round_trips += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _apply_update(self, path, changes):
+        data = self._docs[path]
+        for field, value in changes.items():
+            target = data
+            parts = field.split('.')
+            for part in parts[:-1]:
+                target = target.setdefault(part, {})
+            target[parts[-1]] = copy.deepcopy(value)
+
+    def _merge(self, target, data):
+        # set(..., merge=True) merges nested maps rather than replacing them
+        for key, value in data.items():
+            if isinstance(value, dict) and isinstance(target.get(key), dict):
+                self._merge(target[key], value)
+            else:
+                target[key] = copy.deepcopy(value)
+
+    def collection(self, path):
+        return FakeCollectionReference(self, path)
+
+    def document(self, path):
+        return FakeDocumentReference(self, path)
+
+    def collection_group(self, collection_id):
+        return FakeQuery(self, lambda path: path.split('/')[-2] == collection_id)
+
+    def get_all(self, references):
+        self._round_trip()
+        with self._lock:
+            snapshots = [FakeSnapshot(ref, copy.deepcopy(self._docs.get(ref.path))) for ref in references]
+        yield from snapshots
+
+    def batch(self):
+        return FakeWriteBatch(self)
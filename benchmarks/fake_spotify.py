@@ -0,0 +1,306 @@
+"""
+A tiny stand-in for the Spotify Web API, good enough for benchmarks and
+load tests.
+
+Every response is delayed by `latency` seconds so round trips cost roughly
+what they do against api.spotify.com. Point a spotipy client at it with
+
+    spotify.prefix = server.prefix
+
+or point the whole app at it with SPOTIFY_API_URL=server.prefix.
+
+Knobs:
+    latency         seconds per response
+    rate_limit      requests per second across the server; past it the
+                    server answers 429 with Retry-After: retry_after
+    top_limit       items per range from /me/top/*, paged 50 at a time
+    tracks_per_artist  tracks in /artists/{id}/top-tracks
+    catalog         number of distinct artists users draw their favorites from
+    playlists       playlists every user already has
+    track_seconds   length of the tracks /me/player/currently-playing
+                    cycles through
+
+POST /api/token hands out `token-<code>` access tokens, and /me answers
+with the user named by the token, so each load test user gets a distinct
+identity by logging in with their user ID as the code. Any other token is
+`fake-user`.
+"""
+
+import json
+import re
+import threading
+import time
+from urllib.parse import parse_qsl
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def fake_artist(artist_id):
+    return {
+        'id': artist_id,
+        'name': f'Artist {artist_id}',
+        'popularity': 50,
+        'genres': ['indie'],
+        'images': [{'url': 'https://i.scdn.co/image/x'}],
+        'external_urls': {'spotify': f'https://open.spotify.com/artist/{artist_id}'},
+    }
+
+
+def fake_track(artist_id, n):
+    return {
+        'id': f'{artist_id}track{n}',
+        'name': f'Track {n}',
+        'uri': f'spotify:track:{artist_id}track{n}',
+        'artists': [{'id': artist_id, 'name': f'Artist {artist_id}'}],
+        'album': {'name': f'Album {n}', 'images': [{'url': 'https://i.scdn.co/image/x'}]},
+        'duration_ms': 180000,
+        'external_urls': {'spotify': f'https://open.spotify.com/track/{artist_id}track{n}'},
+    }
+
+
+def fake_user(user_id):
+    return {'id': user_id, 'display_name': f'User {user_id}' if user_id != 'fake-user' else 'Fake User',
+            'country': 'US', 'followers': {'total': 0}, 'product': 'premium',
+            'external_urls': {'spotify': f'https://open.spotify.com/user/{user_id}'}}
+
+
+class FakeSpotifyHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def user_id(self):
+        token = self.headers.get('Authorization', '').partition(' ')[2]
+        return token[len('token-'):] if token.startswith('token-') else 'fake-user'
+
+    def begin(self):
+        # Shared by every verb: latency, rate limit and call counting.
+        # Returns the path without query string, or None once a 429 was sent.
+        # The body is read up front so a 429 leaves the keep-alive connection clean.
+        length = int(self.headers.get('Content-Length') or 0)
+        self.body = self.rfile.read(length) if length else b''
+        time.sleep(self.server.latency)
+        self.server.count(self.path)
+        if not self.server.take_token():
+            self.server.count_rate_limited()
+            self.send_json({'error': {'status': 429, 'message': 'API rate limit exceeded'}}, status=429,
+                           headers={'Retry-After': str(self.server.retry_after)})
+            return None
+        return self.path.partition('?')[0].rstrip('/')
+
+    def do_GET(self):
+        path = self.begin()
+        if path is None:
+            return
+        params = dict(parse_qsl(self.path.partition('?')[2]))
+
+        match = re.match(r'^/v1/artists/([^/]+)/top-tracks$', path)
+        if match:
+            artist_id = match.group(1)
+            return self.send_json({'tracks': [fake_track(artist_id, n) for n in range(self.server.tracks_per_artist)]})
+
+        # Bulk lookups; anything that isn't a fake ID comes back as null, like Spotify
+        if path in ('/v1/artists', '/v1/tracks') and len(params.get('ids', '').split(',')) > 50:
+            return self.send_json({'error': {'status': 400, 'message': 'Too many ids requested'}}, status=400)
+
+        if path == '/v1/artists':
+            ids = params.get('ids', '').split(',')
+            return self.send_json({'artists': [fake_artist(artist_id) if re.match(r'^artist\d+$', artist_id) else None
+                                               for artist_id in ids]})
+
+        if path == '/v1/tracks':
+            tracks = []
+            for track_id in params.get('ids', '').split(','):
+                match = re.match(r'^(artist\d+)track(\d+)$', track_id)
+                tracks.append(fake_track(match.group(1), int(match.group(2))) if match else None)
+            return self.send_json({'tracks': tracks})
+
+        match = re.match(r'^/v1/me/top/(tracks|artists)$', path)
+        if match:
+            limit = min(int(params.get('limit', 20)), 50)
+            offset = int(params.get('offset', 0))
+            time_range = params.get('time_range', 'medium_term')
+            artist_ids = self.server.top_artist_ids(self.user_id(), time_range, self.server.top_limit)
+            page = artist_ids[offset:offset + limit]
+            if match.group(1) == 'artists':
+                items = [fake_artist(artist_id) for artist_id in page]
+            else:
+                items = [fake_track(artist_id, 0) for artist_id in page]
+            next_url = f'{self.server.prefix}me/top/{match.group(1)}?time_range={time_range}&limit={limit}' \
+                       f'&offset={offset + limit}' if offset + limit < len(artist_ids) else None
+            return self.send_json({'items': items, 'total': len(artist_ids), 'limit': limit, 'offset': offset,
+                                   'next': next_url})
+
+        if path == '/v1/me':
+            return self.send_json(fake_user(self.user_id()))
+
+        if path == '/v1/me/player/currently-playing':
+            return self.send_json(self.server.now_playing(self.user_id()))
+
+        match = re.match(r'^/v1/artists/([^/]+)$', path)
+        if match:
+            return self.send_json(fake_artist(match.group(1)))
+
+        match = re.match(r'^/v1/users/([^/]+)$', path)
+        if match:
+            return self.send_json(fake_user(match.group(1)))
+
+        # Users follow their own playlists and the ownerless ones everybody sees
+        match = re.match(r'^/v1/playlists/([^/]+)/followers/contains$', path)
+        if match and match.group(1) in self.server.playlists:
+            owner = self.server.playlists[match.group(1)]['owner']['id']
+            return self.send_json([owner in (None, user_id) for user_id in params.get('ids', '').split(',')])
+
+        match = re.match(r'^/v1/(?:me|users/([^/]+))/playlists$', path)
+        if match:
+            owner = match.group(1) or self.user_id()
+            limit = int(params.get('limit', 50))
+            offset = int(params.get('offset', 0))
+            playlists = self.server.user_playlists(owner)
+            page = playlists[offset:offset + limit]
+            has_next = offset + limit < len(playlists)
+            next_url = f'{self.server.prefix}users/{owner}/playlists?limit={limit}&offset={offset + limit}' \
+                if has_next else None
+            return self.send_json({'items': page, 'total': len(playlists), 'limit': limit, 'offset': offset,
+                                   'next': next_url})
+
+        self.send_json({'error': {'status': 404, 'message': 'not found'}}, status=404)
+
+    def do_POST(self):
+        path = self.begin()
+        if path is None:
+            return
+        body = json.loads(self.body or b'{}') if path.startswith('/v1/') else {}
+
+        if path == '/api/token':
+            form = dict(parse_qsl(self.body.decode()))
+            user_id = form.get('code') or form.get('refresh_token', 'refresh-fake-user')[len('refresh-'):]
+            return self.send_json({'access_token': f'token-{user_id}', 'token_type': 'Bearer', 'expires_in': 3600,
+                                   'refresh_token': f'refresh-{user_id}', 'scope': form.get('scope', '')})
+
+        match = re.match(r'^/v1/users/([^/]+)/playlists$', path)
+        if match:
+            return self.send_json(self.server.create_playlist(body.get('name'), owner=match.group(1)), status=201)
+
+        match = re.match(r'^/v1/playlists/([^/]+)/tracks$', path)
+        if match and match.group(1) in self.server.playlists:
+            playlist = self.server.playlists[match.group(1)]
+            playlist['tracks']['total'] += len(body.get('uris', []))
+            return self.send_json({'snapshot_id': 'snapshot'}, status=201)
+
+        self.send_json({'error': {'status': 404, 'message': 'not found'}}, status=404)
+
+    def do_PUT(self):
+        path = self.begin()
+        if path is None:
+            return
+        body = json.loads(self.body or b'{}')
+
+        match = re.match(r'^/v1/playlists/([^/]+)/tracks$', path)
+        if match and match.group(1) in self.server.playlists:
+            self.server.playlists[match.group(1)]['tracks']['total'] = len(body.get('uris', []))
+            return self.send_json({'snapshot_id': 'snapshot'})
+
+        if re.match(r'^/v1/me/player/play$', path):
+            return self.send_json({}, status=204)
+
+        self.send_json({'error': {'status': 404, 'message': 'not found'}}, status=404)
+
+    def send_json(self, body, status=200, headers=None):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+
+class FakeSpotifyServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, latency=0.05, playlists=0, rate_limit=None, retry_after=1, top_limit=50,
+                 tracks_per_artist=10, catalog=1000, track_seconds=180):
+        super().__init__(('127.0.0.1', 0), FakeSpotifyHandler)
+        self.latency = latency
+        self.rate_limit = rate_limit
+        self.retry_after = retry_after
+        self.top_limit = top_limit
+        self.tracks_per_artist = tracks_per_artist
+        self.catalog = catalog
+        self.track_seconds = track_seconds
+        self.started_at = time.time()
+        self.calls = {}
+        self.rate_limited = 0
+        self.playlists = {}
+        self._lock = threading.Lock()
+        self._tokens = float(rate_limit or 0)
+        self._refilled_at = time.monotonic()
+        for n in range(playlists):
+            self.create_playlist(f'Playlist {n}')
+
+    @property
+    def prefix(self):
+        return f'http://127.0.0.1:{self.server_address[1]}/v1/'
+
+    @property
+    def token_url(self):
+        return f'http://127.0.0.1:{self.server_address[1]}/api/token'
+
+    def top_artist_ids(self, user_id, sp_range, limit):
+        # fake-user's ranges are artist0000.., artist0030.., artist0060..; other
+        # users start somewhere else in the catalog so favorites partly overlap
+        digits = re.sub(r'\D', '', user_id)
+        base = int(digits) * 7 if digits and user_id != 'fake-user' else 0
+        offset = base + {'short_term': 0, 'medium_term': 30, 'long_term': 60}[sp_range]
+        return [f'artist{(offset + n) % self.catalog:04d}' for n in range(limit)]
+
+    def now_playing(self, user_id):
+        # Every user plays their short term top tracks on repeat, one every track_seconds
+        elapsed = time.time() - self.started_at
+        n = int(elapsed // self.track_seconds)
+        artist_ids = self.top_artist_ids(user_id, 'short_term', 10)
+        item = dict(fake_track(artist_ids[n % len(artist_ids)], 0), duration_ms=int(self.track_seconds * 1000))
+        return {'is_playing': True, 'progress_ms': int((elapsed % self.track_seconds) * 1000),
+                'currently_playing_type': 'track', 'item': item}
+
+    def create_playlist(self, name, owner=None):
+        # Playlists without an owner show up for every user
+        with self._lock:
+            playlist_id = f'playlist{len(self.playlists):05d}'
+            self.playlists[playlist_id] = {'id': playlist_id, 'name': name, 'images': [], 'public': True,
+                                           'owner': {'id': owner}, 'tracks': {'total': 0}}
+            return self.playlists[playlist_id]
+
+    def user_playlists(self, owner):
+        with self._lock:
+            return [playlist for playlist in self.playlists.values() if playlist['owner']['id'] in (None, owner)]
+
+    def take_token(self):
+        if not self.rate_limit:
+            return True
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.rate_limit, self._tokens + (now - self._refilled_at) * self.rate_limit)
+            self._refilled_at = now
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            return True
+
+    def count_rate_limited(self):
+        with self._lock:
+            self.rate_limited += 1
+
+    def count(self, path):
+        # Collapse IDs (any segment with a digit) so calls group by endpoint
+        endpoint = path.split('?')[0].rstrip('/')
+        endpoint = '/v1' + re.sub(r'/[^/]*\d[^/]*', '/{id}', endpoint[len('/v1'):]) \
+            if endpoint.startswith('/v1') else endpoint
+        with self._lock:
+            self.calls[endpoint] = self.calls.get(endpoint, 0) + 1
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
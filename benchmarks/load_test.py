@@ -0,0 +1,304 @@
+"""
+Load test: the whole app, served over HTTP, against the fake Spotify API
+and the in-memory Firestore fake (or the memory or SQLite store).
+
+    python benchmarks/load_test.py [--users 20] [--iterations 3]
+        [--spotify-latency 0.05] [--rate-limit 0] [--top-limit 50] [--tracks-per-artist 10]
+        [--storage firestore|memory|sqlite] [--storage-latency 0.01]
+        [--compare REF]
+
+Each virtual user runs its own thread and, per iteration, goes through a
+realistic session: log in (/auth/callback against the fake token
+endpoint), /top_tracks, save top tracks and artists and poll until the
+background jobs finish, /find_users, a solo and a group /create_playlist,
+and /save_playlist.
+
+Reports per route: requests, req/s, p50/p99 latency and errors. Spotify
+and storage calls per request come from the app's /metrics counters, which
+(unlike the Server-Timing header) include work done while a streamed body
+is sent; they are per URL rule, so solo and group /create_playlist share a
+line. Also reports what the fake Spotify API saw per endpoint. Results
+are written to benchmarks/results/<commit>.json. --compare REF (a commit
+prefix or a results file) prints the change against an earlier run.
+"""
+
+import argparse
+import glob
+import json
+import logging
+import os
+import random
+import re
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+os.environ.setdefault('SPOTIPY_REDIRECT_URI', 'http://127.0.0.1:8080')
+os.environ.setdefault('FLASK_SECRET_KEY', 'benchmark')
+os.environ.setdefault('SPOTIPY_CLIENT_ID', 'benchmark')
+os.environ.setdefault('SPOTIPY_CLIENT_SECRET', 'benchmark')
+os.environ.setdefault('SNAPSHOT_SCHEDULER', '0')
+os.environ.setdefault('METRICS_TOKEN', 'benchmark')
+
+import requests  # noqa: E402
+
+from fake_firestore import FakeFirestore  # noqa: E402
+from fake_spotify import FakeSpotifyServer  # noqa: E402
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+METRIC_LINE = re.compile(r'^(\w+)\{(.*)\} (\S+)$')
+NOT_STORAGE = {'spotify', 'queue'}
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+class Recorder:
+    def __init__(self):
+        self.samples = {}  # route -> list of (seconds, ok)
+        self._lock = threading.Lock()
+
+    def add(self, route, seconds, response):
+        ok = response.status_code < 400
+        if ok and response.headers.get('Content-Type', '').startswith('application/json'):
+            ok = response.json().get('success', True) is not False
+        with self._lock:
+            self.samples.setdefault(route, []).append((seconds, ok))
+
+
+def upstream_per_route(metrics_text):
+    # Spotify and storage calls per request for each URL rule, from /metrics
+    requests_by_rule, calls = {}, {}
+    for line in metrics_text.splitlines():
+        match = METRIC_LINE.match(line)
+        if not match:
+            continue
+        name, labels, value = match.groups()
+        labels = dict(re.findall(r'(\w+)="([^"]*)"', labels))
+        if name == 'http_request_seconds_count':
+            rule = labels['route']
+            requests_by_rule[rule] = requests_by_rule.get(rule, 0) + int(value)
+        elif name == 'http_request_upstream_calls_total':
+            kind = 'spotify' if labels['upstream'] == 'spotify' else \
+                None if labels['upstream'] in NOT_STORAGE else 'storage'
+            if kind:
+                key = (labels['route'], kind)
+                calls[key] = calls.get(key, 0) + int(value)
+    return {
+        rule: {
+            'requests': count,
+            'spotify_calls_per_request': calls.get((rule, 'spotify'), 0) / count,
+            'storage_calls_per_request': calls.get((rule, 'storage'), 0) / count,
+        }
+        for rule, count in sorted(requests_by_rule.items()) if count and rule != '/metrics'
+    }
+
+
+class VirtualUser:
+    def __init__(self, base_url, user_id, everyone, recorder):
+        self.base_url = base_url
+        self.user_id = user_id
+        self.everyone = everyone
+        self.recorder = recorder
+        self.http = requests.Session()
+
+    def request(self, method, path, route=None, **kwargs):
+        start = time.perf_counter()
+        response = self.http.request(method, self.base_url + path, allow_redirects=False, **kwargs)
+        response.content  # streamed pages count until the last byte
+        self.recorder.add(route or path.split('?')[0], time.perf_counter() - start, response)
+        return response
+
+    def session(self):
+        self.http.cookies.clear()
+        self.request('GET', f'/auth/callback?code={self.user_id}')
+        self.request('GET', '/top_tracks')
+        self.request('POST', '/save_top_tracks')
+        self.request('POST', '/save_top_artists')
+        for _ in range(200):
+            statuses = [self.request('GET', f'/snapshot_status/{kind}', route='/snapshot_status').json()['status']
+                        for kind in ('tracks', 'artists')]
+            if all(status in ('done', 'failed', 'none') for status in statuses):
+                break
+            time.sleep(0.05)
+        self.request('GET', '/find_users')
+        preview = self.request('GET', '/create_playlist').text
+        others = random.sample(self.everyone, min(3, len(self.everyone)))
+        self.request('GET', '/create_playlist?' + '&'.join(f'users={user_id}' for user_id in others),
+                     route='/create_playlist (group)')
+        match = re.search(r'name="track_ids" value="([^"]*)"', preview)
+        if match:
+            self.request('POST', '/save_playlist', data={'track_ids': match.group(1)})
+
+
+def create_store(kind, latency):
+    if kind == 'firestore':
+        from storage.firestore_store import FirestoreStore
+        db = FakeFirestore(latency=latency)
+        return FirestoreStore(db), db
+    if kind == 'sqlite':
+        from storage.sqlite_store import SqliteStore
+        return SqliteStore(os.path.join(tempfile.mkdtemp(), 'load-test.sqlite3')), None
+    from storage.memory_store import MemoryStore
+    return MemoryStore(), None
+
+
+def run(args):
+    spotify = FakeSpotifyServer(latency=args.spotify_latency, rate_limit=args.rate_limit or None,
+                                top_limit=args.top_limit, tracks_per_artist=args.tracks_per_artist).start()
+    os.environ['SPOTIFY_API_URL'] = spotify.prefix
+
+    import spotipy
+    from werkzeug.serving import make_server
+    import main
+    import storage
+
+    spotipy.oauth2.SpotifyOAuth.OAUTH_TOKEN_URL = spotify.token_url
+    store, db = create_store(args.storage, args.storage_latency)
+    storage.set_store(store)
+
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    server = make_server('127.0.0.1', 0, main.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f'http://127.0.0.1:{server.server_port}'
+
+    user_ids = [f'user{n:05d}' for n in range(1, args.users + 1)]
+    recorder = Recorder()
+    errors = []
+
+    def drive(user_id):
+        user = VirtualUser(base_url, user_id, [other for other in user_ids if other != user_id], recorder)
+        for _ in range(args.iterations):
+            try:
+                user.session()
+            except Exception as e:
+                errors.append(f'{user_id}: {e!r}')
+
+    # The callback prints every token it receives; keep the report readable
+    stdout, sys.stdout = sys.stdout, open(os.devnull, 'w')
+    start = time.perf_counter()
+    try:
+        threads = [threading.Thread(target=drive, args=(user_id,)) for user_id in user_ids]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+    elapsed = time.perf_counter() - start
+    metrics = requests.get(f'{base_url}/metrics', headers={'Authorization': f'Bearer {os.environ["METRICS_TOKEN"]}'})
+    server.shutdown()
+    spotify.shutdown()
+
+    routes = {}
+    for route, samples in sorted(recorder.samples.items()):
+        latencies = [sample[0] for sample in samples]
+        routes[route] = {
+            'requests': len(samples),
+            'rps': len(samples) / elapsed,
+            'p50_ms': percentile(latencies, 0.5) * 1000,
+            'p99_ms': percentile(latencies, 0.99) * 1000,
+            'errors': sum(not sample[1] for sample in samples),
+        }
+    return {
+        'commit': git_commit(),
+        'timestamp': time.time(),
+        'config': vars(args),
+        'elapsed_s': elapsed,
+        'total_rps': sum(route['requests'] for route in routes.values()) / elapsed,
+        'routes': routes,
+        'upstream_per_route': upstream_per_route(metrics.text),
+        'spotify_calls': dict(sorted(spotify.calls.items())),
+        'spotify_rate_limited': spotify.rate_limited,
+        'storage_round_trips': db.round_trips if db is not None else None,
+        'session_errors': errors,
+    }
+
+
+def git_commit():
+    def git(*command):
+        return subprocess.run(['git', *command], cwd=ROOT, capture_output=True, text=True).stdout.strip()
+    commit = git('rev-parse', '--short', 'HEAD') or 'unknown'
+    return commit + ('-dirty' if git('status', '--porcelain', '--untracked-files=no') else '')
+
+
+def load_results(ref):
+    if os.path.exists(ref):
+        path = ref
+    else:
+        matches = sorted(glob.glob(os.path.join(RESULTS_DIR, f'{ref}*.json')))
+        if not matches:
+            sys.exit(f'No results for {ref} in {RESULTS_DIR}')
+        path = matches[0]
+    with open(path) as f:
+        return json.load(f)
+
+
+def report(results, baseline=None):
+    print(f'{results["commit"]}: {results["total_rps"]:.1f} req/s overall over {results["elapsed_s"]:.1f}s')
+    print(f'{"route":<28} {"reqs":>6} {"req/s":>7} {"p50 ms":>8} {"p99 ms":>8} {"errors":>6}')
+    for route, stats in results['routes'].items():
+        line = (f'{route:<28} {stats["requests"]:>6} {stats["rps"]:>7.1f} {stats["p50_ms"]:>8.1f} '
+                f'{stats["p99_ms"]:>8.1f} {stats["errors"]:>6}')
+        before = (baseline or {}).get('routes', {}).get(route)
+        if before:
+            line += (f'   p50 {change(before["p50_ms"], stats["p50_ms"])}'
+                     f' p99 {change(before["p99_ms"], stats["p99_ms"])}')
+        print(line)
+    if baseline:
+        print(f'overall req/s {change(baseline["total_rps"], results["total_rps"])} vs {baseline["commit"]}')
+
+    print(f'\n{"upstream calls (from /metrics)":<28} {"reqs":>6} {"spotify/req":>11} {"storage/req":>11}')
+    for rule, stats in results['upstream_per_route'].items():
+        print(f'{rule:<28} {stats["requests"]:>6} {stats["spotify_calls_per_request"]:>11.1f} '
+              f'{stats["storage_calls_per_request"]:>11.1f}')
+
+    print('\nfake Spotify API calls:')
+    for endpoint, count in results['spotify_calls'].items():
+        print(f'  {endpoint:<40} {count:>7}')
+    print(f'  {"429s sent":<40} {results["spotify_rate_limited"]:>7}')
+    if results['storage_round_trips'] is not None:
+        print(f'storage round trips: {results["storage_round_trips"]}')
+    for error in results['session_errors'][:10]:
+        print(f'session error: {error}')
+
+
+def change(before, after):
+    return f'{(after - before) / before * 100:+.0f}%' if before else 'n/a'
+
+
+def main_():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--iterations', type=int, default=3)
+    parser.add_argument('--spotify-latency', type=float, default=0.05)
+    parser.add_argument('--rate-limit', type=float, default=0, help='Spotify requests/sec, 0 for unlimited')
+    parser.add_argument('--top-limit', type=int, default=50)
+    parser.add_argument('--tracks-per-artist', type=int, default=10)
+    parser.add_argument('--storage', choices=['firestore', 'memory', 'sqlite'], default='firestore')
+    parser.add_argument('--storage-latency', type=float, default=0.01, help='seconds per fake Firestore round trip')
+    parser.add_argument('--compare', help='commit prefix or results file to compare against')
+    parser.add_argument('--no-save', action='store_true', help="don't write benchmarks/results/<commit>.json")
+    args = parser.parse_args()
+
+    baseline = load_results(args.compare) if args.compare else None
+    results = run(args)
+    report(results, baseline)
+
+    if not args.no_save:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        path = os.path.join(RESULTS_DIR, f'{results["commit"]}.json')
+        with open(path, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f'\nsaved {os.path.relpath(path, ROOT)}')
+
+
+if __name__ == '__main__':
+    main_()
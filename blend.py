@@ -0,0 +1,93 @@
+"""
+Group blends: one playlist sampled from several users' stored favorites.
+
+All members' favorites are loaded with a single batched read
+(FavoritesStore.get_group_favorites) and tracks come from their stored top
+tracks, so the common path makes no
+Spotify calls. Members who only saved top artists fall back to those
+artists' (cached) top tracks.
+
+Every member gets an equal share of the playlist. Within a member, tracks
+are sampled without replacement, weighted towards recent ranges and higher
+ranks (Efraimidis-Spirakis keys, so each member costs one pass over their
+tracks), and a track already picked for someone else is skipped.
+"""
+
+import heapq
+import math
+import random
+from operator import itemgetter
+
+from favorites import RANGES
+
+BLEND_SIZE = 30
+MAX_GROUP_SIZE = 100
+RANGE_WEIGHTS = {'short_term': 3.0, 'medium_term': 2.0, 'long_term': 1.0}
+FALLBACK_ARTISTS = 5
+
+
+def fill_missing_tracks(group, fetch_artist_tracks, rng=random):
+    # For members without stored top tracks, use a few of their top artists'
+    # top tracks instead. fetch_artist_tracks(artist_ids) returns one list of
+    # track entries per artist.
+    missing = {}
+    for user_id, favorites in group.items():
+        if any(favorites['tracks']['ranges'].values()):
+            continue
+        artists = [artist['id'] for sp_range in RANGES for artist in favorites['artists']['ranges'][sp_range]]
+        if artists:
+            missing[user_id] = rng.sample(artists, min(FALLBACK_ARTISTS, len(artists)))
+
+    artist_ids = list(dict.fromkeys(artist_id for ids in missing.values() for artist_id in ids))
+    if not artist_ids:
+        return
+    tracks_by_artist = dict(zip(artist_ids, fetch_artist_tracks(artist_ids)))
+    for user_id, ids in missing.items():
+        group[user_id]['tracks']['ranges']['short_term'] = [
+            track for artist_id in ids for track in tracks_by_artist[artist_id]
+        ]
+
+
+def _weighted_order(ranges, rng):
+    # Weighted sampling without replacement: key = u ** (1 / weight), largest first
+    keyed = []
+    for sp_range in RANGES:
+        range_weight = RANGE_WEIGHTS[sp_range]
+        for rank, track in enumerate(ranges.get(sp_range, [])):
+            weight = range_weight / (rank + 1)
+            keyed.append((rng.random() ** (1 / weight), track))
+    return keyed
+
+
+def _take(keyed, count, seen, tracks):
+    taken = 0
+    for _, track in keyed:
+        if taken == count:
+            break
+        if track['track_id'] not in seen:
+            seen.add(track['track_id'])
+            tracks.append(track)
+            taken += 1
+    return taken
+
+
+def build_blend(group, size=BLEND_SIZE, rng=random):
+    members = list(group)
+    if not members:
+        return []
+    rng.shuffle(members)
+    quota = max(1, math.ceil(size / len(members)))
+
+    seen = set()
+    tracks = []
+    for user_id in members:
+        keyed = _weighted_order(group[user_id]['tracks']['ranges'], rng)
+        taken = _take(heapq.nlargest(quota * 2, keyed, key=itemgetter(0)), quota, seen, tracks)
+        if taken < quota:
+            # Lots of overlap with earlier members; walk the rest of this member's tracks
+            _take(sorted(keyed, key=itemgetter(0), reverse=True), quota - taken, seen, tracks)
+        if len(tracks) >= size:
+            break
+
+    rng.shuffle(tracks)
+    return tracks[:size]
@@ -1,6 +1,5 @@
-import spotipy
 import os
-from flask import Blueprint, request, session, redirect
+from flask import Blueprint, request, session, redirect, g
 SPOTIPY_REDIRECT_URI = os.environ.get('SPOTIPY_REDIRECT_URI')
 
 authentication = Blueprint('authentication', __name__)
@@ -18,6 +17,18 @@ scope = [
     'playlist-modify-private'
 ]
 
+
+def _auth_manager(show_dialog=False):
+    # spotipy (and the requests/redis modules it pulls in) is only imported
+    # once a request actually needs it, which keeps cold starts short.
+    import spotipy
+    cache_handler = spotipy.cache_handler.FlaskSessionCacheHandler(session)
+    return spotipy.oauth2.SpotifyOAuth(scope=scope,
+                                       cache_handler=cache_handler,  # use custom cache handler
+                                       redirect_uri=SPOTIPY_REDIRECT_URI,
+                                       show_dialog=show_dialog)
+
+
 @authentication.route('/callback')
 def callback():
     print(f"Using Redirect URI: {SPOTIPY_REDIRECT_URI}")
@@ -30,18 +41,13 @@ def callback():
         return f"Error received from Spotify: {error}", 400
     elif code:
         print(f"Authorization code received: {code}")
-        cache_handler = spotipy.cache_handler.FlaskSessionCacheHandler(session)
-        auth_manager = spotipy.oauth2.SpotifyOAuth(
-            scope=scope,
-            cache_handler=cache_handler,  # use custom cache handler
-            redirect_uri=SPOTIPY_REDIRECT_URI,
-            show_dialog=False
-        )
+        auth_manager = _auth_manager()
         # Exchange the authorization code for an access token
         token_info = auth_manager.get_access_token(code)
         print(f"Token info received: {token_info}")
         # Save the token in the session
         session['token_info'] = token_info
+        session.pop('profile', None)  # may belong to a previously logged in user
         return redirect('/')
     else:
         return "Error: no code provided by Spotify callback.", 400
@@ -51,11 +57,7 @@ def callback():
 def login_with_spotify():
     print(f"Using Redirect URI: {SPOTIPY_REDIRECT_URI}")
 
-    cache_handler = spotipy.cache_handler.FlaskSessionCacheHandler(session)
-    auth_manager = spotipy.oauth2.SpotifyOAuth(scope=scope,
-                                               cache_handler=cache_handler,
-                                               redirect_uri=SPOTIPY_REDIRECT_URI,
-                                               show_dialog=False)
+    auth_manager = _auth_manager()
     auth_url = auth_manager.get_authorize_url()
     return redirect(auth_url)
 
@@ -68,12 +70,32 @@ def sign_out():
 
 
 def ensure_authenticated():
-    cache_handler = spotipy.cache_handler.FlaskSessionCacheHandler(session)
-    auth_manager = spotipy.oauth2.SpotifyOAuth(scope=scope,
-                                               cache_handler=cache_handler,
-                                               redirect_uri=SPOTIPY_REDIRECT_URI,
-                                               show_dialog=True)
-    if not auth_manager.validate_token(cache_handler.get_cached_token()):
+    # Memoized on flask.g so the token is validated once per request, no
+    # matter how many times routes and context processors ask.
+    if 'auth_manager' in g:
+        return g.auth_manager
+
+    # Logged out visitors never need an OAuth manager (or spotipy at all)
+    if not session.get('token_info'):
+        g.auth_manager = None
+        return None
+
+    auth_manager = _auth_manager(show_dialog=True)
+    if not auth_manager.validate_token(auth_manager.cache_handler.get_cached_token()):
+        g.auth_manager = None
         return None
-    session['token_info'] = auth_manager.get_cached_token()  # Store token info in session
+    # validate_token already saved a refreshed token through the cache handler;
+    # only touch the session if it somehow differs, so unchanged sessions aren't rewritten.
+    token_info = auth_manager.get_cached_token()
+    if session.get('token_info') != token_info:
+        session['token_info'] = token_info
+    g.auth_manager = auth_manager
     return auth_manager
+
+
+def get_spotify():
+    # One client per request, sharing the process-wide pooled HTTP session.
+    if 'spotify' not in g:
+        from spotify_client import SpotifyClient
+        g.spotify = SpotifyClient(auth_manager=ensure_authenticated())
+    return g.spotify
@@ -1,8 +1,8 @@
 # current.py
 
-from flask import Blueprint, render_template, redirect
-import spotipy
-from .authentication import ensure_authenticated
+from flask import Blueprint, jsonify, render_template, redirect, request, stream_template
+from .authentication import ensure_authenticated, get_spotify
+from helper_functions import current_profile
 
 current = Blueprint('current', __name__)
 
@@ -13,19 +13,23 @@ def playlists():
     if not auth_manager:
         return redirect('/auth/login_with_spotify')
 
-    spotify = spotipy.Spotify(auth_manager=auth_manager)
-    raw_playlists = spotify.current_user_playlists()["items"]
+    from pagination import PAGE_SIZE, iter_items
+    spotify = get_spotify()
+    # The first page is fetched before streaming starts, so a failure still
+    # gets a proper error page; the rest stream in as they arrive.
+    first_page = spotify.current_user_playlists(limit=PAGE_SIZE)
 
-    formatted_playlists = []
-    for raw_playlist in raw_playlists:
-        formatted_playlist = {
-            "name": raw_playlist["name"],
-            "image_url": raw_playlist["images"][0]["url"] if raw_playlist["images"] else None,
-            "num_tracks": raw_playlist["tracks"]["total"],
-        }
-        formatted_playlists.append(formatted_playlist)
+    def formatted_playlists():
+        # Everything gets shown, so keep a few pages in flight
+        for raw_playlist in iter_items(spotify, first_page, prefetch=4):
+            yield {
+                "name": raw_playlist["name"],
+                "image_url": raw_playlist["images"][0]["url"] if raw_playlist["images"] else None,
+                "num_tracks": raw_playlist["tracks"]["total"],
+                "public": raw_playlist.get("public"),
+            }
 
-    return render_template('playlists.html', playlists=formatted_playlists)
+    return stream_template('playlists.html', playlists=formatted_playlists())
 
 
 @current.route('/currently_playing')
@@ -34,28 +38,27 @@ def currently_playing():
     if not auth_manager:
         return redirect('/auth/login_with_spotify')
 
-    spotify = spotipy.Spotify(auth_manager=auth_manager)
+    import now_playing
+    spotify = get_spotify()
 
-    track = spotify.current_user_playing_track()
+    # Served from the user's shared poller; the page then follows changes
+    # through /currently_playing/next instead of being reloaded.
+    poller = now_playing.poller_for(current_profile(spotify)['id'], auth_manager.get_cached_token())
+    version, context = poller.current()
+    return render_template("currently_playing.html", context=context, version=version)
 
-    if track:
-        artist_id = track['item']['artists'][0]['id']
-        top_tracks = spotify.artist_top_tracks(artist_id, country='US')['tracks']
-        context = {
-            'album_art_url': track['item']['album']['images'][0]['url'],
-            'track_name': track['item']['name'],
-            'artist_name': track['item']['artists'][0]['name'],
-            'top_tracks': top_tracks
-        }
-    else:
-        context = {
-            'album_art_url': None,
-            'track_name': None,
-            'artist_name': None,
-            'top_tracks': None
-        }
 
-    return render_template("currently_playing.html", context=context)
+@current.route('/currently_playing/next')
+def currently_playing_next():
+    auth_manager = ensure_authenticated()
+    if not auth_manager:
+        return jsonify(success=False, error="Not authenticated."), 401
+
+    import now_playing
+    spotify = get_spotify()
+
+    poller = now_playing.poller_for(current_profile(spotify)['id'], auth_manager.get_cached_token())
+    return jsonify(now_playing.next_state(poller, request.args.get('after', -1, type=int)))
 
 
 @current.route('/current_user')
@@ -64,24 +67,17 @@ def current_user():
     if not auth_manager:
         return redirect('/auth/login_with_spotify')
 
-    spotify = spotipy.Spotify(auth_manager=auth_manager)
+    spotify = get_spotify()
 
+    # The full profile isn't kept in the session, so this page asks Spotify
     user_data = spotify.current_user()
 
-    # Extract relevant data fields
-    display_name = user_data.get("display_name")
-    followers_count = user_data.get("followers", {}).get("total")
-    external_url = user_data.get("external_urls", {}).get("spotify")
-    country = user_data.get("country")
-    email = user_data.get("email")
-    product = user_data.get("product")
-
     return render_template(
         'current_user.html',
-        display_name=display_name,
-        followers_count=followers_count,
-        external_url=external_url,
-        country=country,
-        email=email,
-        product=product
+        display_name=user_data.get("display_name"),
+        followers_count=user_data.get("followers", {}).get("total"),
+        external_url=user_data.get("external_urls", {}).get("spotify"),
+        country=user_data.get("country"),
+        email=user_data.get("email"),
+        product=user_data.get("product")
     )
\ No newline at end of file
@@ -1,113 +1,87 @@
-from flask import Blueprint, request, session, redirect, render_template, jsonify
-import spotipy
-from .authentication import ensure_authenticated
-from google.cloud import firestore
+import os
+from concurrent.futures import TimeoutError
+
+from flask import Blueprint, redirect, render_template, jsonify
+from .authentication import ensure_authenticated, get_spotify
+from storage import get_store
+from helper_functions import current_profile
 
 user_favorites = Blueprint('user_favorites', __name__)
-db = firestore.Client()
 
+# How long a page view waits on a missing snapshot before showing a loading page
+SNAPSHOT_WAIT = float(os.environ.get('SNAPSHOT_WAIT', 8))
 
-@user_favorites.route('/top_tracks')
-def top_tracks():
+
+def show_favorites(kind, template):
     auth_manager = ensure_authenticated()
     if not auth_manager:
         return redirect('/auth/login_with_spotify')  # Modify this redirect to your desired route
 
-    spotify = spotipy.Spotify(auth_manager=auth_manager)
-    ranges = ['short_term', 'medium_term', 'long_term']
+    import snapshots
+    user_id = current_profile(get_spotify())['id']
 
-    tracks = {}
+    # Read the precomputed snapshot; only wait on Spotify when it is missing or stale
+    snapshot = snapshots.get_snapshot(user_id, kind)
+    if snapshot is None:
+        job = snapshots.submit(user_id, kind, auth_manager.get_cached_token())
+        try:
+            snapshot = job['future'].result(timeout=SNAPSHOT_WAIT)
+        except TimeoutError:
+            # The job keeps going; the loading page polls it and reloads
+            return render_template('snapshot_loading.html', kind=kind), 202
 
-    for sp_range in ranges:
-        tracks[sp_range] = spotify.current_user_top_tracks(time_range=sp_range, limit=50)['items']
+    return render_template(template, **{kind: snapshot['ranges']})
 
-    return render_template("top_tracks.html", tracks=tracks)
 
-
-@user_favorites.route('/save_top_tracks', methods=['POST'])
-def save_top_tracks():
+def queue_save(kind):
     try:
-        cache_handler = spotipy.cache_handler.FlaskSessionCacheHandler(session)
-        auth_manager = spotipy.oauth2.SpotifyOAuth(cache_handler=cache_handler)
-        if not auth_manager.validate_token(cache_handler.get_cached_token()):
+        auth_manager = ensure_authenticated()
+        if not auth_manager:
             return redirect('/')
 
-        spotify = spotipy.Spotify(auth_manager=auth_manager)
-        ranges = ['short_term', 'medium_term', 'long_term']
-
-        user_id = spotify.me()["id"]
-        user_favorites_ref = db.collection('users').document(user_id).collection('user_favorites').document('top_tracks')
-
-        all_tracks_data = []
-
-        # Store the top tracks in Firestore
-        for sp_range in ranges:
-            results = spotify.current_user_top_tracks(time_range=sp_range, limit=50)
-            for item in results['items']:
-                track_data = {
-                    'name': item['name'],
-                    'artist': item['artists'][0]['name'],
-                    'range': sp_range,
-                    'album': item['album']['name'],
-                    'track_id': item['id'],
-                    'external_url': item['external_urls']['spotify'],
-                    'image_url': item['album']['images'][0]['url'] if item['album']['images'] else None
-                }
-                all_tracks_data.append(track_data)
-
-        user_favorites_ref.set({'tracks': all_tracks_data})
-        return jsonify(success=True, message="Top tracks saved successfully!")
+        import snapshots
+        profile = current_profile(get_spotify())
+        user_id = profile["id"]
+
+        def save(snapshot):
+            store = get_store()
+            if store.save_favorites(user_id, profile['display_name'], kind, snapshot['ranges']) != 'skipped':
+                from similarity import on_save
+                on_save(store, user_id, profile['display_name'])
+
+        # Snapshot and store in the background; the page polls /snapshot_status
+        snapshots.submit(user_id, kind, auth_manager.get_cached_token(), save=save)
+        return jsonify(success=True, message=f"Saving top {kind}...", job=snapshots.job_status(user_id, kind))
     except Exception as e:
         return jsonify(success=False, message=str(e))
 
 
-@user_favorites.route('/top_artists')
-def top_artists():
-    auth_manager = ensure_authenticated()
-    if not auth_manager:
-        return redirect('/auth/login_with_spotify')  # Modify this redirect to your desired route
+@user_favorites.route('/top_tracks')
+def top_tracks():
+    return show_favorites('tracks', "top_tracks.html")
 
-    spotify = spotipy.Spotify(auth_manager=auth_manager)
-    ranges = ['short_term', 'medium_term', 'long_term']
 
-    artists = {}
+@user_favorites.route('/save_top_tracks', methods=['POST'])
+def save_top_tracks():
+    return queue_save('tracks')
 
-    for sp_range in ranges:
-        artists[sp_range] = spotify.current_user_top_artists(time_range=sp_range, limit=50)['items']
 
-    return render_template("top_artists.html", artists=artists)
+@user_favorites.route('/top_artists')
+def top_artists():
+    return show_favorites('artists', "top_artists.html")
 
 
 @user_favorites.route('/save_top_artists', methods=['POST'])
 def save_top_artists():
-    try:
-        cache_handler = spotipy.cache_handler.FlaskSessionCacheHandler(session)
-        auth_manager = spotipy.oauth2.SpotifyOAuth(cache_handler=cache_handler)
-        if not auth_manager.validate_token(cache_handler.get_cached_token()):
-            return redirect('/')
+    return queue_save('artists')
 
-        spotify = spotipy.Spotify(auth_manager=auth_manager)
-        ranges = ['short_term', 'medium_term', 'long_term']
-
-        user_id = spotify.me()["id"]
-        user_favorites_ref = db.collection('users').document(user_id).collection('user_favorites').document('top_artists')
-
-        all_artists_data = []
-
-        # Store the top artists in Firestore
-        for sp_range in ranges:
-            results = spotify.current_user_top_artists(time_range=sp_range, limit=50)
-            for item in results['items']:
-                artist_data = {
-                    'name': item['name'],
-                    'range': sp_range,
-                    'popularity': item['popularity'],
-                    'external_url': item['external_urls']['spotify'],
-                    'id': item['id']
-                }
-                all_artists_data.append(artist_data)
-
-        user_favorites_ref.set({'artists': all_artists_data})
-        return jsonify(success=True, message="Top artists saved successfully!")
-    except Exception as e:
-        return jsonify(success=False, message=str(e))
\ No newline at end of file
+
+@user_favorites.route('/snapshot_status/<kind>')
+def snapshot_status(kind):
+    import snapshots
+    auth_manager = ensure_authenticated()
+    if not auth_manager or kind not in snapshots.KINDS:
+        return jsonify(status='none')
+
+    user_id = current_profile(get_spotify())['id']
+    return jsonify(snapshots.job_status(user_id, kind))
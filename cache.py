@@ -0,0 +1,254 @@
+"""
+Process-wide cache for Spotify data that rarely changes (artist top tracks,
+public user profiles, artist and track metadata).
+
+Entries expire after a per-resource TTL and are evicted least-recently-used
+once the backend grows past CACHE_MAX_BYTES. Concurrent misses for the same
+key are coalesced so only one thread goes upstream.
+
+Backends:
+    CACHE_BACKEND=memory  (default) a dict per process
+    CACHE_BACKEND=sqlite  a WAL-mode SQLite file at CACHE_PATH, shared by every
+                          gunicorn worker on the machine. Its total size is
+                          kept by triggers, and a hit only refreshes the entry's
+                          LRU timestamp once per TOUCH_INTERVAL.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+TTLS = {
+    'artist_top_tracks': 60 * 60,
+    'user': 60 * 60,
+    'artist': 24 * 60 * 60,
+    'track': 24 * 60 * 60,
+    'snapshot': 24 * 60 * 60,
+}
+DEFAULT_TTL = 5 * 60
+CACHE_MAX_BYTES = int(os.environ.get('CACHE_MAX_BYTES', 64 * 1024 * 1024))
+TOUCH_INTERVAL = 60  # seconds; how stale a SQLite entry's LRU timestamp may get
+
+
+class MemoryBackend:
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.evictions = 0
+        self._entries = OrderedDict()  # key -> (expires_at, size, value)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return False, None
+            expires_at, size, value = entry
+            if expires_at < time.time():
+                del self._entries[key]
+                self.size -= size
+                return False, None
+            self._entries.move_to_end(key)
+            return True, value
+
+    def set(self, key, value, ttl):
+        size = len(json.dumps(value))
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.size -= old[1]
+            self._entries[key] = (time.time() + ttl, size, value)
+            self.size += size
+            while self.size > self.max_bytes and len(self._entries) > 1:
+                _, (_, evicted_size, _) = self._entries.popitem(last=False)
+                self.size -= evicted_size
+                self.evictions += 1
+
+
+class SqliteBackend:
+    def __init__(self, path, max_bytes):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.evictions = 0
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        conn = self._conn()
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS cache (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                expires_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )
+        ''')
+        conn.execute('CREATE INDEX IF NOT EXISTS cache_accessed_at ON cache (accessed_at)')
+        # A running total kept by triggers, so checking the bound doesn't scan
+        # the table and every worker sharing the file sees the same number
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS cache_size (
+                id INTEGER PRIMARY KEY CHECK (id = 0),
+                total INTEGER NOT NULL
+            )
+        ''')
+        conn.execute('INSERT OR IGNORE INTO cache_size SELECT 0, COALESCE(SUM(size), 0) FROM cache')
+        conn.executescript('''
+            CREATE TRIGGER IF NOT EXISTS cache_size_insert AFTER INSERT ON cache
+                BEGIN UPDATE cache_size SET total = total + NEW.size; END;
+            CREATE TRIGGER IF NOT EXISTS cache_size_update AFTER UPDATE OF size ON cache
+                BEGIN UPDATE cache_size SET total = total + NEW.size - OLD.size; END;
+            CREATE TRIGGER IF NOT EXISTS cache_size_delete AFTER DELETE ON cache
+                BEGIN UPDATE cache_size SET total = total - OLD.size; END;
+        ''')
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    @property
+    def size(self):
+        return self._conn().execute('SELECT total FROM cache_size').fetchone()[0]
+
+    def get(self, key):
+        now = time.time()
+        conn = self._conn()
+        row = conn.execute('SELECT value, expires_at, accessed_at FROM cache WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return False, None
+        value, expires_at, accessed_at = row
+        if expires_at < now:
+            conn.execute('DELETE FROM cache WHERE key = ?', (key,))
+            return False, None
+        # LRU order only needs to be roughly right; touching a hot key on
+        # every hit would put a write (and the file lock) on the read path
+        if now - accessed_at > TOUCH_INTERVAL:
+            conn.execute('UPDATE cache SET accessed_at = ? WHERE key = ?', (now, key))
+        return True, json.loads(value)
+
+    def set(self, key, value, ttl):
+        now = time.time()
+        payload = json.dumps(value)
+        conn = self._conn()
+        conn.execute('''
+            INSERT INTO cache VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT (key) DO UPDATE SET value = excluded.value, size = excluded.size,
+                expires_at = excluded.expires_at, accessed_at = excluded.accessed_at
+        ''', (key, payload, len(payload), now + ttl, now))
+        excess = self.size - self.max_bytes
+        if excess > 0:
+            # Drop the least recently used rows until we are back under the bound.
+            rows = conn.execute('SELECT key, size FROM cache WHERE key != ? ORDER BY accessed_at', (key,))
+            evicted = []
+            for evicted_key, size in rows:
+                if excess <= 0:
+                    break
+                evicted.append((evicted_key,))
+                excess -= size
+            rows.close()
+            conn.executemany('DELETE FROM cache WHERE key = ?', evicted)
+            with self._lock:
+                self.evictions += len(evicted)
+
+
+class Cache:
+    def __init__(self, backend):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+
+    def get_or_fetch(self, resource, key, fetch):
+        cache_key = f'{resource}:{key}'
+        found, value = self.backend.get(cache_key)
+        if found:
+            self._count(hits=1)
+            return value
+
+        with self._lock:
+            call = self._inflight.get(cache_key)
+            leader = call is None
+            if leader:
+                call = self._inflight[cache_key] = {'done': threading.Event()}
+        if not leader:
+            # Someone else is already fetching this key; wait for their result.
+            self._count(coalesced=1)
+            call['done'].wait()
+            if 'error' in call:
+                raise call['error']
+            return call['value']
+
+        self._count(misses=1)
+        try:
+            value = call['value'] = fetch()
+            self.backend.set(cache_key, value, TTLS.get(resource, DEFAULT_TTL))
+            return value
+        except Exception as e:
+            call['error'] = e
+            raise
+        finally:
+            with self._lock:
+                del self._inflight[cache_key]
+            call['done'].set()
+
+    def _count(self, hits=0, misses=0, coalesced=0):
+        # Many request threads share the counters
+        with self._stats_lock:
+            self.hits += hits
+            self.misses += misses
+            self.coalesced += coalesced
+
+    def get(self, resource, key):
+        found, value = self.backend.get(f'{resource}:{key}')
+        return value if found else None
+
+    def get_many(self, resource, keys):
+        # {key: value} for the keys that are cached, counted like get_or_fetch
+        found = {}
+        for key in keys:
+            hit, value = self.backend.get(f'{resource}:{key}')
+            if hit:
+                found[key] = value
+        self._count(hits=len(found), misses=len(keys) - len(found))
+        return found
+
+    def set(self, resource, key, value):
+        self.backend.set(f'{resource}:{key}', value, TTLS.get(resource, DEFAULT_TTL))
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'coalesced': self.coalesced,
+            'evictions': self.backend.evictions,
+            'size_bytes': self.backend.size,
+        }
+
+
+def _create_backend():
+    if os.environ.get('CACHE_BACKEND', 'memory') == 'sqlite':
+        return SqliteBackend(os.environ.get('CACHE_PATH', '/tmp/bad-playlists-cache.sqlite3'), CACHE_MAX_BYTES)
+    return MemoryBackend(CACHE_MAX_BYTES)
+
+
+cache = Cache(_create_backend())
+
+
+# Cached Spotify lookups
+def cached_artist_top_tracks(spotify, artist_id, country='US'):
+    return cache.get_or_fetch('artist_top_tracks', f'{country}:{artist_id}',
+                              lambda: spotify.artist_top_tracks(artist_id, country=country))
+
+
+def cached_user(spotify, user_id):
+    return cache.get_or_fetch('user', user_id, lambda: spotify.user(user_id))
@@ -0,0 +1,241 @@
+"""
+The shape of stored favorites and of the per-user summaries for /find_users.
+
+Favorites are stored pre-partitioned by range, along with a content hash
+per range:
+
+    {'version': 3,
+     'ranges': {'short_term': <range>, 'medium_term': <range>, 'long_term': <range>},
+     'hashes': {range: content hash}}
+
+so readers never scan the whole list to find a range, and saves can skip
+ranges that haven't changed. A range is stored column by column, one array
+per field, without anything that can be rebuilt: external URLs come from
+the ID, and album art and artist images keep only the part after
+IMAGE_URL_PREFIX.
+
+    {'track_id': [...], 'name': [...], 'artist': [...], 'album': [...], 'image': [...]}
+    {'id': [...], 'name': [...], 'popularity': [...], 'image': [...]}
+
+With FAVORITES_COMPRESSION=zlib a range is written as zlib-compressed JSON
+bytes instead. Older documents are still read: version 2 stored a list of
+entry dicts per range, and before that a flat `{kind: [...]}` list with a
+'range' per entry was partitioned on read. Saves write the new format for
+the ranges they touch, and `flask migrate-favorites` rewrites the rest.
+
+Whatever the format, reads hand back TrackEntry / ArtistEntry objects,
+which can also be used like the dicts they replace (entry['name']).
+
+Every time a user saves their top tracks or artists we also store a small
+summary holding their display name and the top 5 entries per range. Listing
+users is then a paged query instead of reading every favorites document and
+calling Spotify for each user.
+
+Where all of this lives is up to the storage backend, see storage/.
+"""
+
+import hashlib
+import json
+import os
+import sys
+import zlib
+
+RANGES = ['short_term', 'medium_term', 'long_term']
+KINDS = ['artists', 'tracks']
+SUMMARY_SIZE = 5
+ID_FIELDS = {
+    'artists': 'id',
+    'tracks': 'track_id',
+}
+SUMMARY_FIELDS = {
+    'artists': ('id', 'name', 'image_url'),
+    'tracks': ('track_id', 'name', 'artist'),
+}
+PAGE_SIZE = 50
+FORMAT_VERSION = 3
+COMPRESSION = os.environ.get('FAVORITES_COMPRESSION', '')
+IMAGE_URL_PREFIX = 'https://i.scdn.co/image/'
+
+
+class Entry:
+    """A stored favorite. Also answers entry[field] and entry.get(field), like the dicts it replaces."""
+
+    __slots__ = ()
+
+    def __getitem__(self, field):
+        try:
+            return getattr(self, field)
+        except AttributeError:
+            raise KeyError(field) from None
+
+    def get(self, field, default=None):
+        return getattr(self, field, default)
+
+    def to_dict(self):
+        return {field: getattr(self, field) for field in self.FIELDS}
+
+    def __eq__(self, other):
+        return type(other) is type(self) and all(getattr(self, f) == getattr(other, f) for f in self.__slots__)
+
+    def __repr__(self):
+        return f'{type(self).__name__}({self.to_dict()!r})'
+
+
+class TrackEntry(Entry):
+    __slots__ = ('track_id', 'name', 'artist', 'album', 'image_url')
+    FIELDS = ('name', 'artist', 'album', 'track_id', 'external_url', 'image_url')
+
+    def __init__(self, track_id, name, artist, album, image_url):
+        self.track_id = track_id
+        self.name = name
+        self.artist = artist
+        self.album = album
+        self.image_url = image_url
+
+    @property
+    def external_url(self):
+        return f'https://open.spotify.com/track/{self.track_id}'
+
+
+class ArtistEntry(Entry):
+    __slots__ = ('id', 'name', 'popularity', 'image_url')
+    FIELDS = ('name', 'popularity', 'external_url', 'id', 'image_url')
+
+    def __init__(self, id, name, popularity, image_url=None):
+        self.id = id
+        self.name = name
+        self.popularity = popularity
+        self.image_url = image_url
+
+    @property
+    def external_url(self):
+        return f'https://open.spotify.com/artist/{self.id}'
+
+
+def _short_image(url):
+    return url[len(IMAGE_URL_PREFIX):] if url and url.startswith(IMAGE_URL_PREFIX) else url
+
+
+def _full_image(value):
+    return IMAGE_URL_PREFIX + value if value and '://' not in value else value
+
+
+def encode_range(kind, entries):
+    """A range's entries (dicts or Entry objects) -> its stored, columnar form."""
+    if kind == 'tracks':
+        columns = {
+            'track_id': [entry['track_id'] for entry in entries],
+            'name': [entry['name'] for entry in entries],
+            'artist': [entry['artist'] for entry in entries],
+            'album': [entry['album'] for entry in entries],
+            'image': [_short_image(entry.get('image_url')) for entry in entries],
+        }
+    else:
+        columns = {
+            'id': [entry['id'] for entry in entries],
+            'name': [entry['name'] for entry in entries],
+            'popularity': [entry.get('popularity') for entry in entries],
+            'image': [_short_image(entry.get('image_url')) for entry in entries],
+        }
+    if COMPRESSION == 'zlib':
+        return zlib.compress(json.dumps(columns, separators=(',', ':')).encode())
+    return columns
+
+
+def decode_range(kind, stored):
+    """Any stored form of a range (compressed, columnar, or a version 2 list of dicts) -> Entry objects."""
+    if not stored:
+        return []
+    if isinstance(stored, bytes):
+        stored = json.loads(zlib.decompress(stored))
+    if isinstance(stored, list):
+        if kind == 'tracks':
+            return [TrackEntry(entry['track_id'], entry['name'], entry['artist'], entry['album'],
+                               entry.get('image_url')) for entry in stored]
+        return [ArtistEntry(entry['id'], entry['name'], entry.get('popularity'), entry.get('image_url'))
+                for entry in stored]
+    if kind == 'tracks':
+        images = [_full_image(image) for image in stored['image']]
+        return list(map(TrackEntry, stored['track_id'], stored['name'], stored['artist'], stored['album'], images))
+    # Artist images were added after the columnar format; older ranges have none
+    images = [_full_image(image) for image in stored.get('image', [None] * len(stored['id']))]
+    return list(map(ArtistEntry, stored['id'], stored['name'], stored['popularity'], images))
+
+
+def partition_by_range(items):
+    # One pass over a legacy flat list
+    ranges = {sp_range: [] for sp_range in RANGES}
+    for item in items:
+        bucket = ranges.get(item['range'])
+        if bucket is not None:
+            bucket.append(item)
+    return ranges
+
+
+def range_hash(entries):
+    # Decoded entries hash like the dicts they were saved from, so rewriting a
+    # document in a newer format doesn't make its ranges look changed
+    entries = [entry.to_dict() if isinstance(entry, Entry) else entry for entry in entries]
+    return hashlib.sha1(json.dumps(entries, sort_keys=True).encode()).hexdigest()
+
+
+def favorites_document(kind, ranges):
+    return {
+        'version': FORMAT_VERSION,
+        'ranges': {sp_range: encode_range(kind, ranges[sp_range]) for sp_range in RANGES},
+        'hashes': {sp_range: range_hash(ranges[sp_range]) for sp_range in RANGES},
+    }
+
+
+def is_current_range(stored):
+    # Written by encode_range() with the current compression setting
+    return isinstance(stored, bytes) if COMPRESSION == 'zlib' else isinstance(stored, dict)
+
+
+def is_current(data):
+    return data.get('version') == FORMAT_VERSION and all(is_current_range(stored) for stored in data['ranges'].values())
+
+
+def read_favorites(kind, data):
+    """Favorites document data, in any version -> {'ranges': {range: [Entry]}}."""
+    data = data or {}
+    if 'ranges' in data:
+        ranges = {sp_range: decode_range(kind, data['ranges'].get(sp_range)) for sp_range in RANGES}
+    else:
+        ranges = {sp_range: decode_range(kind, entries)
+                  for sp_range, entries in partition_by_range(data.get(kind, [])).items()}
+
+    # Intern IDs so dedup sets and cross-user comparisons hash and compare cheaply
+    id_field = ID_FIELDS[kind]
+    for entries in ranges.values():
+        for entry in entries:
+            setattr(entry, id_field, sys.intern(getattr(entry, id_field)))
+    return {'ranges': ranges}
+
+
+def top_by_range(kind, ranges, size=SUMMARY_SIZE):
+    # Keep only the first `size` entries of each range, trimmed to the fields
+    # the users page shows.
+    fields = SUMMARY_FIELDS[kind]
+    return {
+        sp_range: [{field: entry.get(field) for field in fields} for entry in ranges[sp_range][:size]]
+        for sp_range in RANGES if sp_range in ranges
+    }
+
+
+def summary_document(user_id, display_name, kind, ranges):
+    return {
+        'user_id': user_id,
+        'display_name': display_name,
+        kind: top_by_range(kind, ranges),
+    }
+
+
+def read_summary(user_id, data):
+    empty = {sp_range: [] for sp_range in RANGES}
+    return {
+        'user_id': data.get('user_id', user_id),
+        'display_name': data.get('display_name'),
+        'artists': data.get('artists', empty),
+        'tracks': data.get('tracks', empty),
+    }
@@ -0,0 +1,66 @@
+import contextvars
+import hashlib
+import os
+import threading
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+
+from spotify_client import SpotifyClient
+
+# Shared pool for Spotify fan-out. PER_USER_CONCURRENCY caps how many of those
+# threads a single user token may occupy so one big blend can't starve others.
+MAX_WORKERS = int(os.environ.get('FETCH_WORKERS', 32))
+PER_USER_CONCURRENCY = 8
+
+_executor = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix='spotify-fetch')
+_user_limits = weakref.WeakValueDictionary()
+_user_limits_lock = threading.Lock()
+
+
+def _user_semaphore(user_key):
+    with _user_limits_lock:
+        semaphore = _user_limits.get(user_key)
+        if semaphore is None:
+            semaphore = threading.BoundedSemaphore(PER_USER_CONCURRENCY)
+            _user_limits[user_key] = semaphore
+        return semaphore
+
+
+def worker_client(spotify):
+    # The auth manager reads the token from the Flask session, which isn't
+    # available on pool threads. Resolve the token once on the request thread
+    # (refreshing it if needed) and hand the workers a token-bound client.
+    if spotify._auth:
+        return spotify
+    token = spotify.auth_manager.get_access_token(as_dict=False)
+    return SpotifyClient(auth=token)
+
+
+def submit(client, fetch, item):
+    """
+    Start fetch(client, item) on the pool and return its future. `client`
+    must come from worker_client(). Don't call this from a pool thread:
+    waiting there on another pool task can deadlock a busy pool.
+    """
+    # Acquire the user's slot on the calling thread so waiting never ties up
+    # a pool thread that another user could be using.
+    semaphore = _user_semaphore(hashlib.sha1(client._auth.encode()).hexdigest())
+    semaphore.acquire()
+    # Run in a copy of the caller's context so instrumentation attributes
+    # the call to this request and the scheduler keeps its lane (a context
+    # can't be shared between threads, hence one copy per task).
+    context = contextvars.copy_context()
+    future = _executor.submit(context.run, fetch, client, item)
+    future.add_done_callback(lambda _: semaphore.release())
+    return future
+
+
+def fetch_all(spotify, fetch, items):
+    """Call fetch(client, item) for every item in parallel, preserving order."""
+    items = list(items)
+    if not items:
+        return []
+
+    client = worker_client(spotify)
+    futures = [submit(client, fetch, item) for item in items]
+    return [future.result() for future in futures]
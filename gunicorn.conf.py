@@ -0,0 +1,44 @@
+"""
+Gunicorn settings, picked up automatically when gunicorn starts in this
+directory (`gunicorn main:app`). Command line flags still win.
+
+Requests spend nearly all their time waiting on Spotify or Firestore, so
+how many a worker can keep in flight matters more than CPU:
+
+    WORKER_MODE=sync    (default) threaded workers: WEB_CONCURRENCY processes
+                        x GUNICORN_THREADS threads in flight
+    WORKER_MODE=gevent  cooperative workers: every blocking socket call
+                        (requests to Spotify, gRPC to Firestore) yields, so
+                        one process keeps up to GUNICORN_CONNECTIONS requests
+                        in flight with the same code
+
+gevent mode also raises the defaults for the Spotify fan-out pool and the
+HTTP connection pool, since a worker now has far more requests at once.
+"""
+
+import os
+
+WORKER_MODE = os.environ.get('WORKER_MODE', 'sync')
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8080')}"
+workers = int(os.environ.get('WEB_CONCURRENCY', 1))
+
+if WORKER_MODE == 'sync':
+    worker_class = 'gthread'
+    threads = int(os.environ.get('GUNICORN_THREADS', 8))
+elif WORKER_MODE == 'gevent':
+    worker_class = 'gevent'
+    worker_connections = int(os.environ.get('GUNICORN_CONNECTIONS', 1000))
+    # Read by fetch_engine and spotify_client when the app is imported in the worker
+    os.environ.setdefault('FETCH_WORKERS', '256')
+    os.environ.setdefault('SPOTIFY_POOL_MAXSIZE', '256')
+else:
+    raise ValueError(f"Unknown WORKER_MODE: {WORKER_MODE}")
+
+
+def post_worker_init(worker):
+    if WORKER_MODE == 'gevent':
+        # Firestore talks gRPC, which has its own event loop; make it cooperate
+        # with gevent before the first client is built.
+        from grpc.experimental import gevent as grpc_gevent
+        grpc_gevent.init_gevent()
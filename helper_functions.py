@@ -1,16 +1,35 @@
-def generate_navigation(spotify):
-    navigation = f'''
-        <h2>Hi {spotify.me()["display_name"]}, 
-            <small><a href="/auth/sign_out">[sign out]</a></small>
-        </h2>
-        <a href="/playlists">my playlists</a> | 
-        <a href="/currently_playing">currently playing</a> | 
-        <a href="/current_user">me</a> | 
-        <a href="/find_users">find other users</a> |
-        <a href="/top_tracks">top tracks</a> | 
-        <a href="/top_artists">top artists</a> |
-        <a href="/create_playlist">create missionary blend</a> 
-        <hr>
-        <br>
-    '''
-    return navigation
\ No newline at end of file
+import time
+from functools import lru_cache
+
+from flask import current_app, session
+from markupsafe import Markup
+
+# How long the profile cached in the session is trusted before asking Spotify again
+PROFILE_MAX_AGE = 15 * 60
+
+
+def current_profile(spotify):
+    # The logged in user's id and display name, cached in the session so the
+    # nav and the route handlers share one spotify.current_user() call per
+    # PROFILE_MAX_AGE. The default session is a signed but readable cookie, so
+    # nothing more personal (email, country, ...) goes in it.
+    profile = session.get('profile')
+    if profile and time.time() - profile['fetched_at'] < PROFILE_MAX_AGE:
+        return profile
+
+    user_data = spotify.current_user()
+    profile = {
+        'id': user_data['id'],
+        'display_name': user_data.get('display_name'),
+        'fetched_at': time.time(),
+    }
+    session['profile'] = profile
+    return profile
+
+
+@lru_cache(maxsize=1024)
+def generate_navigation(display_name):
+    # Rendered straight from the jinja env (not render_template) so context
+    # processors don't run again, and memoized per display name.
+    template = current_app.jinja_env.get_template('navigation.html')
+    return Markup(template.render(display_name=display_name))
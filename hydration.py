@@ -0,0 +1,82 @@
+"""
+Artist and track metadata (images, genres, album...) looked up in bulk.
+
+Spotify's multi-ID endpoints take up to 50 artists or tracks per call, so
+resolving N IDs costs N/50 calls instead of N. Every looked up entity is
+kept in the shared cache under its own key (`artist:<id>`, `track:<id>`),
+so overlapping lookups from different requests and users only go upstream
+for the IDs nobody has fetched yet.
+
+    hydrate(spotify, 'artists', ids)    {id: artist} for the IDs Spotify knows
+
+Pages don't call Spotify for metadata: artist images are stored with the
+favorites and summaries when they're saved. `flask backfill-artist-images`
+uses this to add images to summaries saved before that.
+"""
+
+from cache import cache
+
+# kind -> (cache resource, per-call limit)
+ENDPOINTS = {
+    'artists': ('artist', 50),
+    'tracks': ('track', 50),
+}
+
+
+def image_url(images):
+    return images[0]['url'] if images else None
+
+
+# Only what pages show goes into the cache; full track objects carry every
+# available market and are several KB each.
+def artist_metadata(item):
+    return {
+        'id': item['id'],
+        'name': item['name'],
+        'genres': item.get('genres', []),
+        'popularity': item.get('popularity'),
+        'image_url': image_url(item.get('images')),
+        'external_url': item['external_urls']['spotify'],
+    }
+
+
+def track_metadata(item):
+    return {
+        'id': item['id'],
+        'name': item['name'],
+        'artist': item['artists'][0]['name'] if item['artists'] else None,
+        'artist_ids': [artist['id'] for artist in item['artists']],
+        'album': item['album']['name'],
+        'image_url': image_url(item['album'].get('images')),
+        'duration_ms': item.get('duration_ms'),
+        'popularity': item.get('popularity'),
+        'external_url': item['external_urls']['spotify'],
+    }
+
+
+def _fetch_chunk(client, kind, ids):
+    if kind == 'artists':
+        return [artist_metadata(item) for item in client.artists(ids)['artists'] if item]
+    return [track_metadata(item) for item in client.tracks(ids)['tracks'] if item]
+
+
+def hydrate(spotify, kind, ids):
+    """{id: metadata} for `ids`, from the cache where possible and otherwise in chunks of up to 50."""
+    resource, limit = ENDPOINTS[kind]
+    ids = list(dict.fromkeys(ids))
+    found = cache.get_many(resource, ids)
+    missing = [item_id for item_id in ids if item_id not in found]
+    if not missing:
+        return found
+
+    chunks = [missing[start:start + limit] for start in range(0, len(missing), limit)]
+    if len(chunks) == 1:
+        results = [_fetch_chunk(spotify, kind, chunks[0])]
+    else:
+        from fetch_engine import fetch_all
+        results = fetch_all(spotify, lambda client, chunk: _fetch_chunk(client, kind, chunk), chunks)
+    for items in results:
+        for item in items:
+            cache.set(resource, item['id'], item)
+            found[item['id']] = item
+    return found
@@ -0,0 +1,344 @@
+"""
+Where request time goes: Spotify calls, storage calls and template rendering.
+
+Every upstream call is recorded in three places:
+
+  - process-wide counters per upstream endpoint (calls, latency histogram,
+    errors, 429s, retries), served at /metrics in the Prometheus text format
+  - per route, the upstream calls made while serving it (body included),
+    also at /metrics
+  - the current request's timings, sent back as a Server-Timing header, e.g.
+    `spotify;dur=812.3;desc="14 calls", firestore;dur=40.1;desc="1 calls", render;dur=3.2, total;dur=361.0`
+    (upstream durations are summed over calls, so fanned out calls can add
+    up to more than the total; `queue` is time spent waiting on the Spotify
+    scheduler)
+
+Headers go out before the body, so for streamed responses (/find_users,
+/playlists) the Server-Timing header only covers work done before the
+stream starts, and says so with a `streamed` entry. The per-route
+histogram at /metrics waits for the response to close and counts the
+whole request, body included.
+
+Recording is a few dict updates under a lock with no I/O, so it stays on in
+production. Set INSTRUMENTATION=0 to turn it off.
+
+/metrics exposes per-route and per-lane internals, so it only exists when
+METRICS_TOKEN is set, and scrapers must send `Authorization: Bearer <token>`
+(Prometheus: `authorization: {credentials: <token>}`).
+
+Sampling profiler, off by default: PROFILE_ROUTES is a comma separated list
+of URL rules (e.g. /find_users,/create_playlist). A PROFILE_SAMPLE_RATE
+fraction of those requests (default 0.01) have their thread's stack sampled
+every PROFILE_INTERVAL seconds. The collapsed stacks are written to
+PROFILE_DIR, one file per request, ready for flamegraph.pl or speedscope.
+"""
+
+import bisect
+import contextvars
+import hmac
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+ENABLED = os.environ.get('INSTRUMENTATION', '1') != '0'
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+PROFILE_ROUTES = {rule for rule in os.environ.get('PROFILE_ROUTES', '').split(',') if rule}
+PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', 0.01))
+PROFILE_INTERVAL = float(os.environ.get('PROFILE_INTERVAL', 0.005))
+PROFILE_DIR = os.environ.get('PROFILE_DIR', '/tmp/bad-playlists-profiles')
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+
+# Path segments after these are IDs, so /v1/artists/abc/top-tracks is
+# reported as /v1/artists/{id}/top-tracks
+ID_PARENTS = {'albums', 'artists', 'audio-analysis', 'audio-features', 'categories', 'episodes', 'playlists',
+              'shows', 'tracks', 'users'}
+
+
+class Stats:
+    __slots__ = ('count', 'seconds', 'errors', 'rate_limited', 'retries', 'buckets')
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.errors = 0
+        self.rate_limited = 0
+        self.retries = 0
+        self.buckets = [0] * (len(BUCKETS) + 1)
+
+    def observe(self, seconds, error):
+        self.count += 1
+        self.seconds += seconds
+        self.errors += error
+        self.buckets[bisect.bisect_left(BUCKETS, seconds)] += 1
+
+
+class RequestTimings:
+    __slots__ = ('start', 'upstream', 'render_seconds', 'render_start', 'token', 'sampler')
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.upstream = {}  # upstream -> [seconds, calls]
+        self.render_seconds = 0.0
+        self.render_start = None
+        self.token = None
+        self.sampler = None
+
+
+_upstream = {}  # (upstream, endpoint) -> Stats
+_routes = {}  # (route, method, status) -> Stats
+_route_upstream = {}  # (route, method, upstream) -> calls made while serving the route
+_lock = threading.Lock()
+
+# The running request's RequestTimings. fetch_engine copies the context
+# into its pool threads so fanned out calls count too.
+_request_timings = contextvars.ContextVar('request_timings', default=None)
+
+
+def _stats(table, key):
+    stats = table.get(key)
+    if stats is None:
+        stats = table[key] = Stats()
+    return stats
+
+
+def spotify_endpoint(method, url):
+    path = url.split('?', 1)[0]
+    if '://' in path:
+        path = '/' + path.split('://', 1)[1].split('/', 1)[-1]
+    parts = path.split('/')
+    for i in range(1, len(parts)):
+        if parts[i - 1] in ID_PARENTS and parts[i]:
+            parts[i] = '{id}'
+    return f'{method} {"/".join(parts)}'
+
+
+def record(upstream, endpoint, seconds, error=False):
+    if not ENABLED:
+        return
+    with _lock:
+        _stats(_upstream, (upstream, endpoint)).observe(seconds, error)
+    timings = _request_timings.get()
+    if timings is not None:
+        with _lock:
+            entry = timings.upstream.setdefault(upstream, [0.0, 0])
+            entry[0] += seconds
+            entry[1] += 1
+
+
+def record_retry(upstream, endpoint, status=None):
+    if not ENABLED:
+        return
+    with _lock:
+        stats = _stats(_upstream, (upstream, endpoint))
+        stats.retries += 1
+        stats.rate_limited += status == 429
+
+
+@contextmanager
+def timed(upstream, endpoint):
+    start = time.perf_counter()
+    error = False
+    try:
+        yield
+    except BaseException:
+        error = True
+        raise
+    finally:
+        record(upstream, endpoint, time.perf_counter() - start, error)
+
+
+def timed_method(upstream, name, method):
+    def wrapper(*args, **kwargs):
+        with timed(upstream, name):
+            return method(*args, **kwargs)
+    wrapper.__name__ = method.__name__
+    wrapper.__doc__ = method.__doc__
+    wrapper.__wrapped__ = method
+    return wrapper
+
+
+def observe_route(key, timings):
+    route, method, status = key
+    with _lock:
+        _stats(_routes, key).observe(time.perf_counter() - timings.start, status >= 500)
+        for upstream, (_, calls) in timings.upstream.items():
+            upstream_key = (route, method, upstream)
+            _route_upstream[upstream_key] = _route_upstream.get(upstream_key, 0) + calls
+
+
+# Sampling profiler
+class StackSampler(threading.Thread):
+    def __init__(self, thread_id, interval=PROFILE_INTERVAL):
+        super().__init__(name='stack-sampler', daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._done = threading.Event()
+
+    def run(self):
+        while not self._done.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f'{os.path.basename(code.co_filename)}:{code.co_name}')
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def stop(self):
+        self._done.set()
+        self.join()
+
+    def write(self, path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f'{stack} {count}\n')
+
+
+# Flask integration
+def init_app(app):
+    if not ENABLED:
+        return
+    from flask import before_render_template, request, template_rendered
+
+    @app.before_request
+    def start_timing():
+        timings = RequestTimings()
+        timings.token = _request_timings.set(timings)
+        if PROFILE_ROUTES and request.url_rule and request.url_rule.rule in PROFILE_ROUTES \
+                and random.random() < PROFILE_SAMPLE_RATE:
+            timings.sampler = StackSampler(threading.get_ident())
+            timings.sampler.start()
+
+    def render_started(sender, **extra):
+        timings = _request_timings.get()
+        if timings is not None:
+            timings.render_start = time.perf_counter()
+
+    def render_finished(sender, **extra):
+        timings = _request_timings.get()
+        if timings is not None and timings.render_start is not None:
+            timings.render_seconds += time.perf_counter() - timings.render_start
+            timings.render_start = None
+
+    before_render_template.connect(render_started, app, weak=False)
+    template_rendered.connect(render_finished, app, weak=False)
+
+    @app.after_request
+    def add_server_timing(response):
+        timings = _request_timings.get()
+        if timings is None:
+            return response
+        metrics = [f'{upstream};dur={seconds * 1000:.1f};desc="{calls} calls"'
+                   for upstream, (seconds, calls) in sorted(timings.upstream.items())]
+        if timings.render_seconds:
+            metrics.append(f'render;dur={timings.render_seconds * 1000:.1f}')
+        metrics.append(f'total;dur={(time.perf_counter() - timings.start) * 1000:.1f}')
+        if response.is_streamed:
+            metrics.append('streamed;desc="body not included"')
+        response.headers['Server-Timing'] = ', '.join(metrics)
+
+        key = (request.url_rule.rule if request.url_rule else 'unmatched', request.method, response.status_code)
+        if response.is_streamed:
+            # The body hasn't run yet; count the route once it has been sent
+            response.call_on_close(lambda: observe_route(key, timings))
+        else:
+            observe_route(key, timings)
+        return response
+
+    @app.teardown_request
+    def stop_timing(exc):
+        timings = _request_timings.get()
+        if timings is None or timings.token is None:
+            return
+        _request_timings.reset(timings.token)
+        timings.token = None
+        if timings.sampler is not None:
+            timings.sampler.stop()
+            rule = request.url_rule.rule.strip('/').replace('/', '_') or 'index'
+            timings.sampler.write(os.path.join(PROFILE_DIR, f'{rule}-{time.time():.0f}-{threading.get_ident()}.folded'))
+
+    if METRICS_TOKEN:
+        @app.route('/metrics')
+        def metrics():
+            if not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {METRICS_TOKEN}'):
+                return 'Unauthorized\n', 401, {'WWW-Authenticate': 'Bearer'}
+            return metrics_text(), 200, {'Content-Type': 'text/plain; version=0.0.4'}
+
+
+# Prometheus text format
+def _labels(**labels):
+    return ','.join(f'{key}="{value}"' for key, value in labels.items())
+
+
+def _histogram(lines, name, labels, stats):
+    cumulative = 0
+    for bound, count in zip(BUCKETS + ('+Inf',), stats.buckets):
+        cumulative += count
+        lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+    lines.append(f'{name}_sum{{{labels}}} {stats.seconds:.6f}')
+    lines.append(f'{name}_count{{{labels}}} {stats.count}')
+
+
+def metrics_text():
+    from cache import cache
+    from spotify_scheduler import scheduler
+    from storage import write_stats
+
+    with _lock:
+        upstream = sorted(_upstream.items())
+        routes = sorted(_routes.items())
+        route_upstream = sorted(_route_upstream.items())
+
+    lines = ['# TYPE upstream_request_seconds histogram']
+    for (name, endpoint), stats in upstream:
+        _histogram(lines, 'upstream_request_seconds', _labels(upstream=name, endpoint=endpoint), stats)
+    for metric, attribute in (('upstream_errors_total', 'errors'), ('upstream_rate_limited_total', 'rate_limited'),
+                              ('upstream_retries_total', 'retries')):
+        lines.append(f'# TYPE {metric} counter')
+        for (name, endpoint), stats in upstream:
+            lines.append(f'{metric}{{{_labels(upstream=name, endpoint=endpoint)}}} {getattr(stats, attribute)}')
+
+    lines.append('# TYPE http_request_seconds histogram')
+    for (rule, method, status), stats in routes:
+        _histogram(lines, 'http_request_seconds', _labels(route=rule, method=method, status=status), stats)
+    lines.append('# TYPE http_request_upstream_calls_total counter')
+    for (rule, method, name), calls in route_upstream:
+        labels = _labels(route=rule, method=method, upstream=name)
+        lines.append(f'http_request_upstream_calls_total{{{labels}}} {calls}')
+
+    cache_stats = cache.stats()
+    for key in ('hits', 'misses', 'coalesced', 'evictions'):
+        lines.append(f'# TYPE cache_{key}_total counter')
+        lines.append(f'cache_{key}_total {cache_stats[key]}')
+    lines.append('# TYPE cache_size_bytes gauge')
+    lines.append(f'cache_size_bytes {cache_stats["size_bytes"]}')
+
+    scheduler_stats = scheduler.stats()
+    lines.append('# TYPE spotify_scheduler_waiting gauge')
+    for lane in ('interactive', 'background'):
+        lines.append(f'spotify_scheduler_waiting{{{_labels(lane=lane)}}} {scheduler_stats["waiting_" + lane]}')
+    lines.append('# TYPE spotify_scheduler_shed_total counter')
+    lines.append(f'spotify_scheduler_shed_total {scheduler_stats["shed"]}')
+    lines.append('# TYPE spotify_scheduler_paused_seconds gauge')
+    lines.append(f'spotify_scheduler_paused_seconds {scheduler_stats["paused_for"]:.3f}')
+
+    # now_playing pulls in spotipy; until a /currently_playing request has
+    # imported it there are no pollers to report
+    now_playing = sys.modules.get('now_playing')
+    now_playing_stats = now_playing.stats() if now_playing else {'pollers': 0, 'waiters': 0}
+    lines.append('# TYPE now_playing_pollers gauge')
+    lines.append(f'now_playing_pollers {now_playing_stats["pollers"]}')
+    lines.append('# TYPE now_playing_waiters gauge')
+    lines.append(f'now_playing_waiters {now_playing_stats["waiters"]}')
+
+    lines.append('# TYPE favorites_saves_total counter')
+    for outcome, count in sorted(write_stats.items()):
+        lines.append(f'favorites_saves_total{{{_labels(outcome=outcome)}}} {count}')
+    return '\n'.join(lines) + '\n'
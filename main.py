@@ -7,6 +7,7 @@ Prerequisites
     export SPOTIPY_CLIENT_ID=client_id_here
     export SPOTIPY_CLIENT_SECRET=client_secret_here
     export SPOTIPY_REDIRECT_URI='http://127.0.0.1:8080' // must contain a port
+    export FLASK_SECRET_KEY=some_long_random_string // REQUIRED, signs the session cookie; no default
     // SPOTIPY_REDIRECT_URI must be added to your [app settings](https://developer.spotify.com/dashboard/applications)
     OPTIONAL
     // in development environment for debug output
@@ -24,20 +25,28 @@ Run app.py
 """
 
 import os
-from flask import Flask, session, request, redirect, jsonify, render_template, flash, url_for
-from flask_session import Session
-import spotipy
+from flask import Flask, session, request, redirect, jsonify, render_template, stream_template, flash, url_for
 import urllib.parse
 from urllib.parse import urlparse
-from google.cloud import firestore
-from helper_functions import generate_navigation
+from helper_functions import generate_navigation, current_profile
+from sessions import configure_sessions
+import instrumentation
+from spotify_scheduler import SpotifyBusy
+from blend import MAX_GROUP_SIZE, fill_missing_tracks, build_blend
+from cache import cached_artist_top_tracks, cached_user
+from favorites import RANGES, PAGE_SIZE
+from storage import get_store
 from random import sample
 import random
 
-from blueprints.authentication import authentication, ensure_authenticated
+from blueprints.authentication import authentication, ensure_authenticated, get_spotify
 from blueprints.user_favorites import user_favorites
 from blueprints.current import current
 
+# Modules that need spotipy (fetch_engine, snapshots, playlists) are imported
+# inside the routes that use them, so a cold start only pays for Flask until
+# the first logged in request comes in.
+
 app = Flask(__name__, template_folder='templates')
 app.register_blueprint(authentication, url_prefix='/auth')
 app.register_blueprint(user_favorites)
@@ -49,13 +58,19 @@ SPOTIPY_REDIRECT_URI = os.environ.get('SPOTIPY_REDIRECT_URI')
 FLASK_SECRET_KEY = os.environ.get('FLASK_SECRET_KEY')
 encoded_redirect_uri = urllib.parse.quote(SPOTIPY_REDIRECT_URI)
 
-app.config['SESSION_TYPE'] = 'cookie'  # Use cookie-based sessions
-app.config['SESSION_TYPE'] = 'filesystem'
-app.config['SESSION_FILE_DIR'] = '/tmp'
+app.secret_key = FLASK_SECRET_KEY
+
+configure_sessions(app)
+instrumentation.init_app(app)
 
-Session(app)
 
-db = firestore.Client()
+@app.errorhandler(SpotifyBusy)
+def spotify_busy(e):
+    # Shed by the Spotify scheduler (or still rate limited after retrying)
+    headers = {'Retry-After': str(e.retry_after)}
+    if request.method != 'GET' or request.path.startswith(('/api/', '/snapshot_status')):
+        return jsonify(success=False, error=str(e)), 503, headers
+    return str(e), 503, headers
 
 
 @app.context_processor
@@ -65,8 +80,9 @@ def inject_navigation():
         # If not authenticated, don't attempt to generate navigation
         return dict(navigation=None)
 
-    spotify = spotipy.Spotify(auth_manager=auth_manager)
-    navigation = generate_navigation(spotify)
+    # Only goes to Spotify when the profile cached in the session is missing or stale
+    spotify = get_spotify()
+    navigation = generate_navigation(current_profile(spotify)['display_name'])
     return dict(navigation=navigation)
 
 
@@ -85,62 +101,45 @@ def create_playlist():
     if not auth_manager:
         return redirect('/auth/login_with_spotify')
 
-    spotify = spotipy.Spotify(auth_manager=auth_manager)
+    spotify = get_spotify()
 
     # 1. Identify who is logged in
-    user_data = spotify.current_user()
-    user_id = user_data['id']
-
-    # 2. Fetch the user's top tracks from Firestore
-    user_ref = db.collection('users').document(user_id)
-    top_artists_ref = user_ref.collection('user_favorites').document('top_artists')
+    user_id = current_profile(spotify)['id']
 
-    top_artists_data = top_artists_ref.get().to_dict()['artists']
+    # Users picked on /find_users get a group blend with the logged in user
+    member_ids = request.args.getlist('users')
+    if member_ids:
+        return render_template('preview.html', tracks=group_blend(spotify, [user_id] + member_ids))
 
-    # Filter artists based on the range
-    short_term_artists = [artist for artist in top_artists_data if artist['range'] == 'short_term']
-    medium_term_artists = [artist for artist in top_artists_data if artist['range'] == 'medium_term']
-    long_term_artists = [artist for artist in top_artists_data if artist['range'] == 'long_term']
+    # 2. Fetch the user's top artists from storage, already partitioned by range
+    top_artists = get_store().get_favorites(user_id, 'artists')
 
-    # Fetch a larger sample to have a buffer for replacements.
+    # Take up to 5 unique artists per range from a random buffer of 10, so each
+    # range costs O(buffer) no matter how many artists the user has stored.
     BUFFER_SIZE = 10
-    short_term_sample = sample(short_term_artists, min(BUFFER_SIZE, len(short_term_artists)))
-    medium_term_sample = sample(medium_term_artists, min(BUFFER_SIZE, len(medium_term_artists)))
-    long_term_sample = sample(long_term_artists, min(BUFFER_SIZE, len(long_term_artists)))
-
-    samples = {
-        'short_term': short_term_sample,
-        'medium_term': medium_term_sample,
-        'long_term': long_term_sample
-    }
-
     seen = set()
     unique_artists = []
-
-    # Helper function to add a unique artist from a term sample.
-    def add_unique_artist(term):
-        for artist in samples[term]:
+    for term in RANGES:
+        term_artists = top_artists['ranges'][term]
+        count = 0
+        for artist in sample(term_artists, min(BUFFER_SIZE, len(term_artists))):
+            if count == 5:
+                break
             if artist['id'] not in seen:
                 seen.add(artist['id'])
                 unique_artists.append(artist)
-                samples[term].remove(artist)
-                return True
-        return False
-
-    # Add unique artists until the list contains 5 from each term or the sample lists are exhausted.
-    for term in ['short_term', 'medium_term', 'long_term']:
-        count = 0
-        while count < 5 and samples[term]:
-            if add_unique_artist(term):
                 count += 1
 
-    # 3. Fetch top 10 tracks for each artist from Spotify
+    # 3. Fetch top 10 tracks for each artist from Spotify (in parallel)
+    from fetch_engine import fetch_all
+    from snapshots import track_entry
+    all_artist_tracks = fetch_all(spotify, lambda client, artist: cached_artist_top_tracks(client, artist['id']),
+                                  unique_artists)
     tracks = []
-    for artist in unique_artists:
-        artist_tracks = spotify.artist_top_tracks(artist['id'])
+    for artist_tracks in all_artist_tracks:
         # 4. Randomly select 2 songs from the top tracks
         selected_tracks = sample(artist_tracks['tracks'], 2)
-        tracks.extend(selected_tracks)
+        tracks.extend(track_entry(track) for track in selected_tracks)
 
     random.shuffle(tracks)
 
@@ -148,6 +147,22 @@ def create_playlist():
     return render_template('preview.html', tracks=tracks)
 
 
+def group_blend(spotify, member_ids):
+    member_ids = list(dict.fromkeys(member_ids))[:MAX_GROUP_SIZE]
+    # Everyone's favorites in one batched read
+    group = get_store().get_group_favorites(member_ids)
+
+    def fetch_artist_tracks(artist_ids):
+        from fetch_engine import fetch_all
+        from snapshots import track_entry
+        results = fetch_all(spotify, lambda client, artist_id: cached_artist_top_tracks(client, artist_id), artist_ids)
+        return [[track_entry(track) for track in result['tracks']] for result in results]
+
+    # Only members who never saved their top tracks cost Spotify calls
+    fill_missing_tracks(group, fetch_artist_tracks)
+    return build_blend(group)
+
+
 @app.route('/save_playlist', methods=['POST'])
 def save_playlist():
     try:
@@ -155,34 +170,14 @@ def save_playlist():
         if not auth_manager:
             return redirect('/auth/login_with_spotify')
 
-        spotify = spotipy.Spotify(auth_manager=auth_manager)
+        spotify = get_spotify()
 
         # Extract track_ids from the POST request
         track_ids = request.form['track_ids'].split(',')
 
-        user_data = spotify.current_user()
-
-        # Fetch the user's existing playlists
-        user_playlists = spotify.user_playlists(user_data['id'])['items']
-
-        # Check if "Your Missionary Blend" playlist already exists
-        playlist_id = None
-        for playlist in user_playlists:
-            if playlist['name'] == "Your Missionary Blend":
-                playlist_id = playlist['id']
-                break
-
-        # If playlist exists, overwrite its tracks. Otherwise, create a new playlist.
-        if playlist_id:
-            # Clear the existing tracks in the playlist
-            spotify.playlist_replace_items(playlist_id, [])
-            # Add new tracks to the playlist
-            spotify.playlist_add_items(playlist_id, track_ids)
-        else:
-            # Create a new playlist
-            playlist = spotify.user_playlist_create(user_data['id'], "Your Missionary Blend")
-            # Add tracks to the new playlist
-            spotify.playlist_add_items(playlist['id'], track_ids)
+        user_id = current_profile(spotify)['id']
+        from playlists import save_blend
+        save_blend(get_store(), spotify, user_id, track_ids)
 
         flash("Playlist saved successfully!")
         return jsonify(success=True)
@@ -198,60 +193,85 @@ def find_users():
     if not auth_manager:
         return redirect('/auth/login_with_spotify')
 
-    spotify = spotipy.Spotify(auth_manager=auth_manager)
-
-    user_favorites_ref = db.collection_group('user_favorites')
-    user_favorites = user_favorites_ref.stream()
-
-    seen_user_ids = set() # Track user IDs that have already been seen
-    user_data_list = []
-
-    def divide_by_range(items):
-        short_term = [item for item in items if item['range'] == 'short_term']
-        medium_term = [item for item in items if item['range'] == 'medium_term']
-        long_term = [item for item in items if item['range'] == 'long_term']
-        return short_term[:5], medium_term[:5], long_term[:5]
-
-    for user_favorite_doc in user_favorites:
-        user_id = user_favorite_doc.reference.parent.parent.id
-        if user_id not in seen_user_ids:
-            seen_user_ids.add(user_id)
-
-            # Fetch top artists document
-            top_artists_ref = db.document(f'users/{user_id}/user_favorites/top_artists')
-            top_artists_doc = top_artists_ref.get()
-            top_artists_data = top_artists_doc.to_dict() if top_artists_doc.exists else {}
-            top_artists = top_artists_data.get('artists', [])  # Assuming 'artists' is a list within the document
-
-            # Fetch top tracks document
-            top_tracks_ref = db.document(f'users/{user_id}/user_favorites/top_tracks')
-            top_tracks_doc = top_tracks_ref.get()
-            top_tracks_data = top_tracks_doc.to_dict() if top_tracks_doc.exists else {}
-            top_tracks = top_tracks_data.get('tracks', [])  # Assuming 'tracks' is a list within the document
-
-            short_term_artists, medium_term_artists, long_term_artists = divide_by_range(top_artists)
-            short_term_tracks, medium_term_tracks, long_term_tracks = divide_by_range(top_tracks)
-
-            # Append to user data list
-            spotify_user_info = spotify.user(user_id)
-            display_name = spotify_user_info['display_name']
-            user_data = {
-                'user_id': user_id,
-                'display_name': display_name,
-                'artists': {
-                    'short_term': short_term_artists,
-                    'medium_term': medium_term_artists,
-                    'long_term': long_term_artists,
-                },
-                'tracks': {
-                    'short_term': short_term_tracks,
-                    'medium_term': medium_term_tracks,
-                    'long_term': long_term_tracks,
-                }
-            }
-            user_data_list.append(user_data)
-
-    return render_template("find_users.html", users=user_data_list)
+    # Stream the page while paging through the denormalized summaries written
+    # by the save endpoints, so the first users show up right away.
+    # Most similar listeners were worked out when favorites were saved (see similarity.py)
+    spotify = get_spotify()
+    store = get_store()
+    neighbors = store.get_user(current_profile(spotify)['id']).get('neighbors', [])
+    return stream_template("find_users.html", neighbors=neighbors, users=store.iter_summaries())
+
+
+@app.route('/api/users')
+def api_users():
+    auth_manager = ensure_authenticated()
+    if not auth_manager:
+        return jsonify(success=False, error="Not authenticated."), 401
+
+    cursor = request.args.get('cursor')
+    page_size = min(request.args.get('page_size', PAGE_SIZE, type=int), 100)
+    users, next_cursor = get_store().summary_page(cursor, max(page_size, 1))
+    return jsonify(users=users, next_cursor=next_cursor)
+
+
+@app.cli.command('backfill-summaries')
+def backfill_summaries_command():
+    """Write user_summaries documents for users who saved favorites before they existed."""
+    store = get_store()
+    if not hasattr(store, 'backfill_summaries'):
+        print("Only Firestore has favorites from before summaries existed; nothing to do.")
+        return
+    import spotipy
+    spotify = spotipy.Spotify(auth_manager=spotipy.oauth2.SpotifyClientCredentials())
+    count = store.backfill_summaries(lambda user_id: cached_user(spotify, user_id)['display_name'])
+    print(f"Backfilled {count} user summaries.")
+
+
+@app.cli.command('backfill-artist-images')
+def backfill_artist_images_command():
+    """Add artist images to summaries saved before images were stored with them."""
+    import spotipy
+    from hydration import hydrate
+    from spotify_client import SpotifyClient
+    store = get_store()
+    spotify = SpotifyClient(auth_manager=spotipy.oauth2.SpotifyClientCredentials())
+    updated = 0
+    cursor = None
+    while True:
+        users, cursor = store.summary_page(cursor, PAGE_SIZE)
+        missing = {artist['id'] for user in users for sp_range in RANGES
+                   for artist in user['artists'][sp_range] if not artist.get('image_url')}
+        # One bulk lookup per page of users, 50 artists per call
+        found = hydrate(spotify, 'artists', list(missing)) if missing else {}
+        for user in users:
+            artists = user['artists']
+            if not any(artist['id'] in found for sp_range in RANGES for artist in artists[sp_range]):
+                continue
+            store.update_summary_artists(user['user_id'], {
+                sp_range: [dict(artist, image_url=found[artist['id']]['image_url'])
+                           if not artist.get('image_url') and artist['id'] in found else artist
+                           for artist in artists[sp_range]]
+                for sp_range in RANGES
+            })
+            updated += 1
+        if cursor is None:
+            break
+    print(f"Added artist images to {updated} user summaries.")
+
+
+@app.cli.command('migrate-favorites')
+def migrate_favorites_command():
+    """Rewrite stored favorites in the current (columnar, optionally compressed) format."""
+    print(f"Migrated {get_store().migrate_favorites()} favorites documents.")
+
+
+@app.cli.command('rebuild-similarity')
+def rebuild_similarity_command():
+    """Recompute every user's most similar listeners from their stored favorites."""
+    from similarity import index
+    store = get_store()
+    index.load(store)
+    print(f"Stored neighbors for {index.store_all(store)} users.")
 
 
 # Helper Functions for Playback Controls in Currently Playing
@@ -261,10 +281,13 @@ def play_track(track_uri):
     if not auth_manager:
         return redirect('/auth/login_with_spotify')
 
-    spotify = spotipy.Spotify(auth_manager=auth_manager)
+    spotify = get_spotify()
 
     try:
         spotify.start_playback(uris=[track_uri])
+        # Let open /currently_playing tabs pick up the new track right away
+        import now_playing
+        now_playing.refresh(current_profile(spotify)['id'])
         return jsonify(success=True)
     except:
         return jsonify(success=False, message="Playback error.")
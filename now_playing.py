@@ -0,0 +1,219 @@
+"""
+Live "currently playing" for /currently_playing.
+
+Each user gets one poller thread per process, however many tabs they have
+open. The page and its long-poll (/currently_playing/next) read the
+poller's latest state, so a page view or reload makes no Spotify calls
+while the poller is fresh.
+
+The poller asks Spotify what's playing at an adaptive interval: just after
+the current track should end, but never less often than MAX_INTERVAL (to
+catch skips). Paused or idle players are polled every PAUSED_INTERVAL and
+IDLE_INTERVAL. Subscribers are only notified when the track or play state
+changes, and the artist's top tracks come from the shared cache. Spotify
+calls therefore scale with track changes, not page views.
+
+A tab asks /currently_playing/next?after=<version> and the request returns
+as soon as the state moves past that version, or after LONG_POLL_SECONDS
+with the state unchanged; the tab then asks again. A waiting request holds
+a worker thread in WORKER_MODE=sync (GUNICORN_THREADS of them per worker),
+so at most MAX_WAITERS requests per process wait at once. Past that they
+get the current state straight away and a `retry_in` to come back after,
+i.e. plain polling, which leaves threads for everything else.
+
+Pollers stop once nobody has watched them for IDLE_GRACE seconds. With
+several gunicorn workers a user's tabs may land on different workers, each
+with its own poller.
+"""
+
+import logging
+import os
+import threading
+import time
+
+from cache import cached_artist_top_tracks
+from snapshots import background_auth_manager
+from spotify_client import SpotifyClient
+from spotify_scheduler import lane
+
+MIN_INTERVAL = 2
+MAX_INTERVAL = int(os.environ.get('NOW_PLAYING_MAX_INTERVAL', 30))
+PAUSED_INTERVAL = 15
+IDLE_INTERVAL = 30
+ERROR_INTERVAL = 30
+TRACK_END_SLACK = 1
+IDLE_GRACE = 60
+LONG_POLL_SECONDS = 25
+# Waiting requests tie up a thread each in sync mode, so they get a quarter
+# of the worker's threads; gevent waits are cheap
+if os.environ.get('WORKER_MODE', 'sync') == 'gevent':
+    MAX_WAITERS = int(os.environ.get('NOW_PLAYING_MAX_WAITERS', 1000))
+else:
+    MAX_WAITERS = int(os.environ.get('NOW_PLAYING_MAX_WAITERS',
+                                     max(int(os.environ.get('GUNICORN_THREADS', 8)) // 4, 1)))
+BUSY_RETRY = 10
+
+EMPTY = {
+    'track_id': None,
+    'is_playing': False,
+    'album_art_url': None,
+    'track_name': None,
+    'artist_name': None,
+    'top_tracks': None,
+}
+
+_pollers = {}  # user_id -> Poller
+_lock = threading.Lock()
+_waiters = 0  # long-poll requests waiting in this process
+_waiters_lock = threading.Lock()
+
+logger = logging.getLogger(__name__)
+
+
+def next_poll_in(playback):
+    # Seconds until it's worth asking Spotify again
+    if not playback or not playback.get('item'):
+        return IDLE_INTERVAL
+    if not playback.get('is_playing'):
+        return PAUSED_INTERVAL
+    remaining = (playback['item']['duration_ms'] - (playback.get('progress_ms') or 0)) / 1000
+    return min(max(remaining + TRACK_END_SLACK, MIN_INTERVAL), MAX_INTERVAL)
+
+
+def playback_state(client, playback, previous):
+    # Podcast episodes have no artists to show top tracks for
+    if not playback or not playback.get('item') or playback.get('currently_playing_type', 'track') != 'track':
+        return EMPTY
+    item = playback['item']
+    state = {
+        'track_id': item['id'],
+        'is_playing': playback.get('is_playing', False),
+        'album_art_url': item['album']['images'][0]['url'] if item['album']['images'] else None,
+        'track_name': item['name'],
+        'artist_name': item['artists'][0]['name'],
+        'top_tracks': previous['top_tracks'] if previous['track_id'] == item['id'] else None,
+    }
+    if state['top_tracks'] is None:
+        top_tracks = cached_artist_top_tracks(client, item['artists'][0]['id'], country='US')['tracks']
+        state['top_tracks'] = [{'name': track['name'], 'uri': track['uri']} for track in top_tracks]
+    return state
+
+
+class Poller(threading.Thread):
+    def __init__(self, user_id, token_info):
+        super().__init__(name=f'now-playing-{user_id}', daemon=True)
+        self.user_id = user_id
+        self.client = SpotifyClient(auth_manager=background_auth_manager(token_info))
+        self.state = None
+        self.version = 0  # bumped on every change, so a tab can ask for what's newer than what it has
+        self.waiters = 0
+        self.watched_at = time.monotonic()
+        self._ready = threading.Event()
+        self._wake = threading.Event()
+        self._cond = threading.Condition()
+
+    def run(self):
+        while True:
+            with _lock, self._cond:
+                if not self.waiters and time.monotonic() - self.watched_at > IDLE_GRACE:
+                    _pollers.pop(self.user_id, None)
+                    return
+            try:
+                # A page waits on the first poll; later ones yield to page loads
+                with lane('interactive' if self.state is None else 'background'):
+                    playback = self.client.current_user_playing_track()
+                    state = playback_state(self.client, playback, self.state or EMPTY)
+                self.publish(state)
+                interval = next_poll_in(playback)
+            except Exception:
+                logger.warning("Currently playing poll for %s failed", self.user_id, exc_info=True)
+                interval = ERROR_INTERVAL
+            self._ready.set()
+            self._wake.wait(interval)
+            self._wake.clear()
+
+    def publish(self, state):
+        # Only changes wake waiting tabs; the playback position doesn't count
+        with self._cond:
+            if state == self.state:
+                return
+            self.state = state
+            self.version += 1
+            self._cond.notify_all()
+
+    def current(self, timeout=10):
+        """(version, state) now, waiting for the first poll if there hasn't been one yet."""
+        self.watch()
+        self._ready.wait(timeout)
+        with self._cond:
+            return self.version, self.state or EMPTY
+
+    def watch(self):
+        with self._cond:
+            self.watched_at = time.monotonic()
+
+    def wait_for_change(self, after, timeout):
+        """(version, state) once the version differs from `after`, or as it is after `timeout` seconds."""
+        self._ready.wait(timeout)
+        with self._cond:
+            self.waiters += 1
+            try:
+                self._cond.wait_for(lambda: self.version != after, timeout)
+            finally:
+                self.waiters -= 1
+                self.watched_at = time.monotonic()
+            return self.version, self.state or EMPTY
+
+    def refresh(self):
+        # Poll now instead of waiting out the interval (e.g. after /play_track)
+        self._wake.set()
+
+
+def poller_for(user_id, token_info):
+    """The user's running poller, started if there isn't one."""
+    with _lock:
+        poller = _pollers.get(user_id)
+        if poller is None:
+            poller = _pollers[user_id] = Poller(user_id, token_info)
+            poller.start()
+        else:
+            # The tab's token may be fresher than the one the poller started with
+            poller.client.auth_manager.cache_handler.save_token_to_cache(token_info)
+        poller.watch()
+        return poller
+
+
+def refresh(user_id):
+    with _lock:
+        poller = _pollers.get(user_id)
+    if poller is not None:
+        poller.refresh()
+
+
+def next_state(poller, after):
+    """
+    The long-poll behind /currently_playing/next: {'version', 'state',
+    'retry_in'}, returned once the state moves past `after`, or after
+    LONG_POLL_SECONDS. When MAX_WAITERS requests are already waiting it
+    answers right away and tells the tab to poll again in BUSY_RETRY seconds.
+    """
+    global _waiters
+    with _waiters_lock:
+        busy = _waiters >= MAX_WAITERS
+        if not busy:
+            _waiters += 1
+    if busy:
+        version, state = poller.current()
+        return {'version': version, 'state': state, 'retry_in': BUSY_RETRY}
+    try:
+        version, state = poller.wait_for_change(after, LONG_POLL_SECONDS)
+    finally:
+        with _waiters_lock:
+            _waiters -= 1
+    return {'version': version, 'state': state, 'retry_in': 0}
+
+
+def stats():
+    with _lock:
+        pollers = len(_pollers)
+    return {'pollers': pollers, 'waiters': _waiters}
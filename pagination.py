@@ -0,0 +1,83 @@
+"""
+Lazy walks over Spotify's paged responses (playlists, top items...).
+
+    first = spotify.current_user_playlists(limit=50)
+    for playlist in iter_items(spotify, first):
+        ...
+
+Pages are only requested as the caller gets to them, and only one page at
+a time is held. With `prefetch` the next `prefetch` pages are already in
+flight on the fetch_engine pool while the caller works through the current
+one. Offset-paged responses say where every later page starts (`limit`,
+`offset`, `total`), so a full walk overlaps its round trips instead of
+making them one after another. Stopping early (break, return, or closing
+the generator) cancels pages that haven't been sent yet, so finding
+something on page one costs at most `prefetch` extra calls.
+
+Code already running on the pool (fetch_all tasks) must use prefetch=0,
+see fetch_engine.submit().
+"""
+
+from collections import deque
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+PAGE_SIZE = 50
+
+
+def _later_pages(page):
+    # URLs of every page after this one for offset-paged responses, or None
+    # when the response doesn't say (cursor paging): follow `next` instead.
+    if not page.get('next') or page.get('total') is None or not page.get('limit'):
+        return None
+    parts = urlsplit(page['next'])
+    query = dict(parse_qsl(parts.query))
+    if 'offset' not in query:
+        return None
+    limit = int(query.get('limit', page['limit']))
+    return [urlunsplit(parts._replace(query=urlencode(dict(query, offset=offset))))
+            for offset in range(int(query['offset']), page['total'], limit)]
+
+
+def _get_page(client, url):
+    return client._get(url)
+
+
+def iter_pages(spotify, page, prefetch=1):
+    """Yield `page` and every page after it."""
+    from fetch_engine import submit, worker_client
+
+    urls = deque(_later_pages(page) or []) if prefetch else deque()
+    client = worker_client(spotify) if urls else None
+    in_flight = deque()
+    try:
+        while page:
+            # Keep up to `prefetch` of the known later pages in flight
+            while urls and len(in_flight) < prefetch:
+                in_flight.append(submit(client, _get_page, urls.popleft()))
+            yield page
+            if in_flight:
+                page = in_flight.popleft().result()
+            elif client is None and page.get('next'):
+                page = spotify.next(page)
+            else:
+                page = None
+    finally:
+        for future in in_flight:
+            future.cancel()
+
+
+def iter_items(spotify, page, prefetch=1, max_items=None):
+    """Yield the items of `page` and every page after it, stopping after `max_items`."""
+    count = 0
+    pages = iter_pages(spotify, page, prefetch)
+    try:
+        for page in pages:
+            for item in page['items']:
+                if max_items is not None and count >= max_items:
+                    return
+                yield item
+                count += 1
+            if max_items is not None and count >= max_items:
+                return
+    finally:
+        pages.close()
@@ -0,0 +1,97 @@
+"""
+Saving a blend to the user's "Your Missionary Blend" playlist.
+
+The playlist ID is remembered in the user's stored settings, so saving
+doesn't scan the user's playlists. Spotify "deletes" a playlist by
+unfollowing it, so a stored ID is checked against the user's follows before
+it's written to. The tracks
+are written with one replace call plus 100-item adds (Spotify's per-request
+limit). The settings also keep a hash of the last saved track list. A
+double submit or retry of the same blend is a no-op, and saves for one user
+are serialized in-process, so concurrent submits can't interleave their
+writes.
+"""
+
+import hashlib
+import threading
+import weakref
+
+import spotipy
+
+from pagination import PAGE_SIZE, iter_items
+
+BLEND_PLAYLIST_NAME = "Your Missionary Blend"
+MAX_ITEMS_PER_REQUEST = 100
+
+_user_locks = weakref.WeakValueDictionary()
+_user_locks_lock = threading.Lock()
+
+
+def _user_lock(user_id):
+    with _user_locks_lock:
+        lock = _user_locks.get(user_id)
+        if lock is None:
+            lock = _user_locks[user_id] = threading.Lock()
+        return lock
+
+
+def tracks_hash(track_ids):
+    return hashlib.sha1(','.join(track_ids).encode()).hexdigest()
+
+
+def find_blend_playlist(spotify, user_id):
+    # Only used when we haven't stored the ID yet: walk every page, not just
+    # the first, stopping as soon as it turns up
+    for playlist in iter_items(spotify, spotify.user_playlists(user_id, limit=PAGE_SIZE)):
+        if playlist['name'] == BLEND_PLAYLIST_NAME:
+            return playlist['id']
+    return None
+
+
+def is_following(spotify, playlist_id, user_id):
+    # One cheap call before writing to a stored ID; a playlist that's gone entirely 404s
+    try:
+        return spotify.playlist_is_following(playlist_id, [user_id])[0]
+    except spotipy.SpotifyException as e:
+        if e.http_status != 404:
+            raise
+        return False
+
+
+def write_tracks(spotify, playlist_id, track_ids):
+    # Replace sets the first 100 tracks (or clears the playlist); the rest are appended
+    spotify.playlist_replace_items(playlist_id, track_ids[:MAX_ITEMS_PER_REQUEST])
+    for start in range(MAX_ITEMS_PER_REQUEST, len(track_ids), MAX_ITEMS_PER_REQUEST):
+        spotify.playlist_add_items(playlist_id, track_ids[start:start + MAX_ITEMS_PER_REQUEST])
+
+
+def save_blend(store, spotify, user_id, track_ids):
+    """Returns True if Spotify was updated, False if this exact blend was already saved."""
+    digest = tracks_hash(track_ids)
+
+    with _user_lock(user_id):
+        stored = store.get_user(user_id)
+        playlist_id = stored.get('blend_playlist_id')
+        if playlist_id and stored.get('blend_tracks_hash') == digest:
+            return False
+
+        if playlist_id is not None and not is_following(spotify, playlist_id, user_id):
+            playlist_id = None  # Deleting a playlist only unfollows it, and it still takes writes
+
+        if playlist_id is None:
+            playlist_id = find_blend_playlist(spotify, user_id)
+
+        if playlist_id is not None:
+            try:
+                write_tracks(spotify, playlist_id, track_ids)
+            except spotipy.SpotifyException as e:
+                if e.http_status != 404:
+                    raise
+                playlist_id = None  # The stored playlist is gone; start a new one
+
+        if playlist_id is None:
+            playlist_id = spotify.user_playlist_create(user_id, BLEND_PLAYLIST_NAME)['id']
+            write_tracks(spotify, playlist_id, track_ids)
+
+        store.update_user(user_id, {'blend_playlist_id': playlist_id, 'blend_tracks_hash': digest})
+        return True
@@ -0,0 +1,50 @@
+"""
+Session storage.
+
+Sessions only hold the Spotify token and the user's id and display name
+(see helper_functions.current_profile), so by default
+they live in Flask's signed (and zlib-compressed) cookie: no server-side
+state, nothing to share between instances, no disk I/O. The cookie is signed, not encrypted: anything in the session
+can be read by whoever holds it.
+
+Every backend signs with FLASK_SECRET_KEY, and the app refuses to start
+without it.
+
+    SESSION_BACKEND=cookie      (default) signed cookie, needs FLASK_SECRET_KEY
+    SESSION_BACKEND=redis       server-side via Flask-Session, at REDIS_URL
+    SESSION_BACKEND=filesystem  the old Flask-Session file store in /tmp
+"""
+
+import os
+
+from flask.sessions import SecureCookieSessionInterface
+
+
+def configure_sessions(app, backend=None, redis_client=None):
+    backend = backend or os.environ.get('SESSION_BACKEND', 'cookie')
+
+    # Only send a new cookie / write the store when the session actually changed.
+    app.config['SESSION_REFRESH_EACH_REQUEST'] = False
+
+    if not app.secret_key:
+        raise RuntimeError("FLASK_SECRET_KEY must be set; it signs the session")
+
+    if backend == 'cookie':
+        app.session_interface = SecureCookieSessionInterface()
+    elif backend == 'redis':
+        if redis_client is None:
+            import redis
+            redis_client = redis.from_url(os.environ.get('REDIS_URL', 'redis://localhost:6379'))
+        # Any client speaking the Redis protocol works, e.g. fakeredis in tests.
+        app.config['SESSION_TYPE'] = 'redis'
+        app.config['SESSION_REDIS'] = redis_client
+        app.config['SESSION_USE_SIGNER'] = True
+        from flask_session import Session
+        Session(app)
+    elif backend == 'filesystem':
+        app.config['SESSION_TYPE'] = 'filesystem'
+        app.config['SESSION_FILE_DIR'] = '/tmp'
+        from flask_session import Session
+        Session(app)
+    else:
+        raise ValueError(f"Unknown SESSION_BACKEND: {backend}")
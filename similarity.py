@@ -0,0 +1,236 @@
+"""
+Taste similarity between users, for "most similar listeners" on /find_users.
+
+A user's saved favorites become one sparse vector over artists and tracks,
+each entry weighted by range and rank the same way blends weight tracks
+(RANGE_WEIGHTS[range] / (rank + 1), summed over ranges) and the vector
+normalized, so the similarity of two users is the dot product of their
+rows (cosine). All rows live in a SciPy CSR matrix:
+
+  - a rebuild computes every user's neighbors from M @ M.T, in blocks of
+    rows so memory stays bounded
+  - a save replaces one row and computes that user's similarities with one
+    sparse product. Only users whose top NEIGHBORS list the saver enters,
+    moves in or leaves get their lists recomputed (and rewritten).
+
+Each user's list is stored on their user record as
+`neighbors: [{'user_id', 'display_name', 'score'}, ...]`, so the page reads
+it with one get_user instead of comparing anyone.
+
+Saves don't wait for any of this: on_save() queues the update for one
+updater thread per process, which applies them in order. The matrix is per
+process and built from storage on first use, then rebuilt by the same
+thread once it is INDEX_MAX_AGE old. A rebuild loads into a fresh index and
+swaps it in, so readers never wait on the reload. Lists in storage are
+shared, so with several workers a save is scored against that worker's
+copy. `flask rebuild-similarity` recomputes and stores everyone's list.
+"""
+
+import logging
+import queue
+import threading
+import time
+
+import numpy as np
+from scipy import sparse
+
+from blend import RANGE_WEIGHTS
+from favorites import ID_FIELDS, KINDS, RANGES
+
+NEIGHBORS = 10
+BLOCK_SIZE = 256
+LOAD_BATCH_SIZE = 100
+INDEX_MAX_AGE = 60 * 60
+REBUILD_CHECK_INTERVAL = 60
+
+logger = logging.getLogger(__name__)
+
+
+def taste_vector(favorites):
+    """{'artists': ..., 'tracks': ...} read_favorites() shaped favorites -> {feature: weight}, L2 normalized."""
+    weights = {}
+    for kind in KINDS:
+        id_field = ID_FIELDS[kind]
+        for sp_range in RANGES:
+            range_weight = RANGE_WEIGHTS[sp_range]
+            for rank, entry in enumerate(favorites.get(kind, {}).get('ranges', {}).get(sp_range, [])):
+                feature = f'{kind[0]}:{entry[id_field]}'
+                weights[feature] = weights.get(feature, 0.0) + range_weight / (rank + 1)
+    norm = sum(weight * weight for weight in weights.values()) ** 0.5
+    return {feature: weight / norm for feature, weight in weights.items()} if norm else {}
+
+
+def top_k(scores, user_ids, exclude, k=NEIGHBORS):
+    # The k highest positive scores, best first, leaving out `exclude` (a row index)
+    scores = scores.copy()
+    scores[exclude] = 0
+    count = min(k, len(scores))
+    candidates = np.argpartition(-scores, count - 1)[:count] if count else []
+    return [(float(scores[i]), user_ids[i]) for i in sorted(candidates, key=lambda i: -scores[i]) if scores[i] > 0]
+
+
+class SimilarityIndex:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.user_ids = []  # row -> user_id
+        self.rows = {}  # user_id -> row
+        self.display_names = {}
+        self.features = {}  # feature -> column
+        self.vectors = []  # row -> (columns, weights)
+        self.neighbors = {}  # user_id -> [(score, user_id)], best first
+        self.built_at = None
+        self._matrix = None
+
+    def _set_vector(self, user_id, display_name, vector):
+        columns = np.fromiter((self.features.setdefault(feature, len(self.features)) for feature in vector),
+                              dtype=np.int32, count=len(vector))
+        weights = np.fromiter(vector.values(), dtype=np.float32, count=len(vector))
+        row = self.rows.get(user_id)
+        if row is None:
+            row = self.rows[user_id] = len(self.user_ids)
+            self.user_ids.append(user_id)
+            self.vectors.append(None)
+        self.vectors[row] = (columns, weights)
+        if display_name is not None:
+            self.display_names[user_id] = display_name
+        self._matrix = None
+
+    def matrix(self):
+        if self._matrix is None:
+            indptr = np.zeros(len(self.vectors) + 1, dtype=np.int64)
+            indptr[1:] = np.cumsum([len(columns) for columns, _ in self.vectors])
+            indices = np.concatenate([columns for columns, _ in self.vectors]) if self.vectors else []
+            data = np.concatenate([weights for _, weights in self.vectors]) if self.vectors else []
+            self._matrix = sparse.csr_matrix((data, indices, indptr), shape=(len(self.vectors), len(self.features)))
+        return self._matrix
+
+    def _compute_neighbors(self, rows):
+        # Neighbors for the given rows, BLOCK_SIZE rows of M @ M.T at a time
+        matrix = self.matrix()
+        transposed = matrix.T.tocsc()
+        result = {}
+        for start in range(0, len(rows), BLOCK_SIZE):
+            block = rows[start:start + BLOCK_SIZE]
+            scores = (matrix[block] @ transposed).toarray()
+            for row, row_scores in zip(block, scores):
+                result[self.user_ids[row]] = top_k(row_scores, self.user_ids, row)
+        return result
+
+    def stale(self):
+        return self.built_at is None or time.time() - self.built_at > INDEX_MAX_AGE
+
+    def load(self, store):
+        # The reload reads every user's favorites, so it fills a separate index
+        # and only takes the lock to swap it in
+        fresh = SimilarityIndex()
+        fresh._load(store)
+        with self._lock:
+            for name, value in vars(fresh).items():
+                if name != '_lock':
+                    setattr(self, name, value)
+
+    def _load(self, store):
+        # Rebuild from every user with a summary, LOAD_BATCH_SIZE favorites at a time
+        batch = []
+        for summary in store.iter_summaries():
+            self.display_names[summary['user_id']] = summary['display_name']
+            batch.append(summary['user_id'])
+            if len(batch) == LOAD_BATCH_SIZE:
+                self._load_batch(store, batch)
+                batch = []
+        self._load_batch(store, batch)
+        self.neighbors = self._compute_neighbors(list(range(len(self.user_ids))))
+        self.built_at = time.time()
+
+    def _load_batch(self, store, user_ids):
+        if user_ids:
+            for user_id, favorites in store.get_group_favorites(user_ids).items():
+                self._set_vector(user_id, None, taste_vector(favorites))
+
+    def update(self, store, user_id, display_name):
+        """
+        Re-score `user_id` after they saved favorites and store every list
+        that changed because of it. Returns the user_ids whose lists were rewritten.
+        """
+        if self.built_at is None:
+            self.load(store)
+        favorites = store.get_group_favorites([user_id])[user_id]
+        with self._lock:
+            self._set_vector(user_id, display_name, taste_vector(favorites))
+            row = self.rows[user_id]
+            matrix = self.matrix()
+            scores = (matrix @ matrix[row].T).toarray().ravel()
+
+            changed = {user_id: top_k(scores, self.user_ids, row)}
+            # Others only change if this user was in their list or now beats its last entry
+            affected = []
+            for other, other_row in self.rows.items():
+                if other == user_id:
+                    continue
+                current = self.neighbors.get(other, [])
+                listed = any(neighbor == user_id for _, neighbor in current)
+                beats = scores[other_row] > 0 and (len(current) < NEIGHBORS or scores[other_row] > current[-1][0])
+                if listed or beats:
+                    affected.append(other_row)
+            for other, neighbors in self._compute_neighbors(affected).items():
+                if neighbors != self.neighbors.get(other):
+                    changed[other] = neighbors
+            self.neighbors.update(changed)
+            stored = {other: self.stored_neighbors(other) for other in changed}
+
+        for other, neighbors in stored.items():
+            store.update_user(other, {'neighbors': neighbors})
+        return list(stored)
+
+    def stored_neighbors(self, user_id):
+        return [{'user_id': other, 'display_name': self.display_names.get(other), 'score': round(score, 4)}
+                for score, other in self.neighbors.get(user_id, [])]
+
+    def store_all(self, store):
+        with self._lock:
+            stored = {user_id: self.stored_neighbors(user_id) for user_id in self.user_ids}
+        for user_id, neighbors in stored.items():
+            store.update_user(user_id, {'neighbors': neighbors})
+        return len(stored)
+
+
+index = SimilarityIndex()
+
+
+_updates = queue.Queue()  # (store, user_id, display_name)
+_updater = None
+_updater_lock = threading.Lock()
+
+
+def on_save(store, user_id, display_name):
+    # Called after a favorites save wrote something. Queued rather than run
+    # here so the save (and the snapshot worker running it) isn't held up.
+    global _updater
+    if _updater is None:
+        with _updater_lock:
+            if _updater is None:
+                _updater = threading.Thread(target=_update_loop, name='similarity-updater', daemon=True)
+                _updater.start()
+    _updates.put((store, user_id, display_name))
+
+
+def _update_loop():
+    store = None
+    while True:
+        try:
+            update = _updates.get(timeout=REBUILD_CHECK_INTERVAL)
+        except queue.Empty:
+            update = None
+        # Similarity is a nice to have; a failure here never fails a save
+        try:
+            if update is not None:
+                store = update[0]
+            if store is not None and index.stale():
+                index.load(store)
+            if update is not None:
+                index.update(*update)
+        except Exception:
+            logger.warning("Similarity update failed", exc_info=True)
+        finally:
+            if update is not None:
+                _updates.task_done()
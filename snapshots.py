@@ -0,0 +1,252 @@
+"""
+Background snapshots of a user's top tracks and artists.
+
+A snapshot is every page of top items per range (up to MAX_TOP_ITEMS),
+converted to the per-range entries we store in Firestore and kept in the
+shared cache. The /top_tracks and /top_artists views and the save endpoints
+all read the same snapshot, so a save right after a page view makes no
+Spotify calls.
+
+Snapshots are built by two small worker pools: one for jobs a page or a
+save button is waiting on, and one for the scheduler's refreshes, so a
+refresh pass (whose Spotify calls wait in the background lane) never
+queues ahead of a page view. Jobs are deduplicated per user and kind,
+report their status, and are forgotten JOB_TTL after they finish. Users
+who have saved are remembered (up to MAX_TRACKED_USERS, least recently
+saved dropped first), and a scheduler thread refreshes (and re-saves)
+their stale snapshots in batches.
+"""
+
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import spotipy
+
+from cache import cache
+from favorites import RANGES
+from fetch_engine import fetch_all
+from pagination import PAGE_SIZE, iter_items
+from spotify_client import SpotifyClient
+from spotify_scheduler import lane
+
+SNAPSHOT_MAX_AGE = 30 * 60
+# Spotify pages top items 50 at a time; keep stored favorites to a sane size
+MAX_TOP_ITEMS = int(os.environ.get('MAX_TOP_ITEMS', 200))
+REFRESH_INTERVAL = 5 * 60
+REFRESH_BATCH_SIZE = 20
+WORKERS = 4
+BACKGROUND_WORKERS = 2
+JOB_TTL = 10 * 60
+MAX_TRACKED_USERS = int(os.environ.get('SNAPSHOT_MAX_TRACKED_USERS', 10000))
+SCHEDULER_ENABLED = os.environ.get('SNAPSHOT_SCHEDULER', '1') != '0'
+
+logger = logging.getLogger(__name__)
+
+
+def track_entry(item):
+    return {
+        'name': item['name'],
+        'artist': item['artists'][0]['name'],
+        'album': item['album']['name'],
+        'track_id': item['id'],
+        'external_url': item['external_urls']['spotify'],
+        'image_url': item['album']['images'][0]['url'] if item['album']['images'] else None
+    }
+
+
+def artist_entry(item):
+    return {
+        'name': item['name'],
+        'popularity': item['popularity'],
+        'external_url': item['external_urls']['spotify'],
+        'id': item['id'],
+        'image_url': item['images'][0]['url'] if item.get('images') else None
+    }
+
+
+def top_items(first_page):
+    # Each range runs on the fetch_engine pool already, so its pages are
+    # walked without prefetching (see pagination.py)
+    def fetch(client, sp_range):
+        return list(iter_items(client, first_page(client, sp_range), prefetch=0, max_items=MAX_TOP_ITEMS))
+    return fetch
+
+
+KINDS = {
+    'tracks': (top_items(lambda client, sp_range: client.current_user_top_tracks(time_range=sp_range,
+                                                                                 limit=PAGE_SIZE)), track_entry),
+    'artists': (top_items(lambda client, sp_range: client.current_user_top_artists(time_range=sp_range,
+                                                                                   limit=PAGE_SIZE)), artist_entry),
+}
+
+_executor = ThreadPoolExecutor(max_workers=WORKERS, thread_name_prefix='snapshot')
+_background_executor = ThreadPoolExecutor(max_workers=BACKGROUND_WORKERS, thread_name_prefix='snapshot-refresh')
+_jobs = {}  # (user_id, kind) -> latest job
+_tracked = OrderedDict()  # user_id -> {'auth_manager': ..., 'saves': {kind: save}} for the scheduler
+_lock = threading.Lock()
+_scheduler = None
+_pruned_at = 0
+
+
+def get_snapshot(user_id, kind, max_age=SNAPSHOT_MAX_AGE):
+    snapshot = cache.get('snapshot', f'{user_id}:{kind}')
+    if snapshot and 'ranges' in snapshot and time.time() - snapshot['fetched_at'] < max_age:
+        return snapshot
+    return None
+
+
+def fetch_snapshot(client, user_id, kind):
+    fetch, to_entry = KINDS[kind]
+    results = fetch_all(client, fetch, RANGES)
+    snapshot = {
+        'fetched_at': time.time(),
+        'ranges': {sp_range: [to_entry(item) for item in items] for sp_range, items in zip(RANGES, results)},
+    }
+    cache.set('snapshot', f'{user_id}:{kind}', snapshot)
+    return snapshot
+
+
+def background_auth_manager(token_info):
+    # Keeps (and refreshes) its own copy of the token, since jobs run outside
+    # the request and can't reach the Flask session.
+    cache_handler = spotipy.cache_handler.MemoryCacheHandler(token_info)
+    return spotipy.oauth2.SpotifyOAuth(cache_handler=cache_handler, scope=token_info.get('scope'))
+
+
+def _run(job, auth_manager):
+    with _lock:
+        if job['status'] == 'superseded':
+            return None  # a page view took it over before it started
+        job['status'] = 'running'
+    try:
+        snapshot = get_snapshot(job['user_id'], job['kind'])
+        if snapshot is None:
+            # Scheduled refreshes wait behind page loads for their Spotify calls
+            with lane('background' if job['background'] else 'interactive'):
+                snapshot = fetch_snapshot(SpotifyClient(auth_manager=auth_manager), job['user_id'], job['kind'])
+        with _lock:
+            job['status'] = 'saving'
+            save = job['save']
+        if save is not None:
+            save(snapshot)
+        with _lock:
+            job['status'] = 'done'
+            job['finished_at'] = time.time()
+        return snapshot
+    except Exception as e:
+        with _lock:
+            job['status'] = 'failed'
+            job['error'] = str(e)
+            job['finished_at'] = time.time()
+            if job['background']:
+                # Most likely a revoked token; stop refreshing until the user saves again.
+                _tracked.pop(job['user_id'], None)
+        raise
+
+
+def submit(user_id, kind, token_info, save=None):
+    """Queue a snapshot (and optionally a save) unless one is already pending for this user."""
+    auth_manager = background_auth_manager(token_info)
+    if save is not None:
+        # Remember the user so the scheduler keeps their saved favorites fresh
+        with _lock:
+            tracked = _tracked.setdefault(user_id, {'saves': {}})
+            tracked['auth_manager'] = auth_manager
+            tracked['saves'][kind] = save
+            _tracked.move_to_end(user_id)
+            while len(_tracked) > MAX_TRACKED_USERS:
+                _tracked.popitem(last=False)
+    return _submit(user_id, kind, auth_manager, save)
+
+
+def _submit(user_id, kind, auth_manager, save, background=False):
+    with _lock:
+        _prune_jobs()
+        job = _jobs.get((user_id, kind))
+        if job and job['status'] in ('queued', 'running'):
+            if background or not job['background']:
+                if save is not None:
+                    job['save'] = save
+                return job
+            # Someone is waiting on a job the scheduler queued: run it on the
+            # interactive pool instead of behind the rest of the refresh pass
+            if job['status'] == 'queued':
+                job['status'] = 'superseded'
+                save = save or job['save']
+
+        job = {
+            'user_id': user_id,
+            'kind': kind,
+            'status': 'queued',
+            'error': None,
+            'save': save,
+            'background': background,
+            'queued_at': time.time(),
+            'finished_at': None,
+        }
+        _jobs[(user_id, kind)] = job
+        executor = _background_executor if background else _executor
+        job['future'] = executor.submit(_run, job, auth_manager)
+
+    _ensure_scheduler()
+    return job
+
+
+def _prune_jobs():
+    # Forget finished jobs (and the snapshots their futures hold); called with
+    # _lock held, at most once a minute
+    global _pruned_at
+    now = time.time()
+    if now - _pruned_at < 60:
+        return
+    _pruned_at = now
+    for key, job in list(_jobs.items()):
+        if job['finished_at'] is not None and now - job['finished_at'] > JOB_TTL:
+            del _jobs[key]
+
+
+def job_status(user_id, kind):
+    job = _jobs.get((user_id, kind))
+    if job is None:
+        return {'status': 'none'}
+    return {field: job[field] for field in ('kind', 'status', 'error', 'queued_at', 'finished_at')}
+
+
+def refresh_stale():
+    # Re-snapshot (and re-save) tracked users whose snapshots have gone stale,
+    # at most REFRESH_BATCH_SIZE jobs per pass.
+    with _lock:
+        tracked = list(_tracked.items())
+    submitted = 0
+    for user_id, state in tracked:
+        for kind, save in state['saves'].items():
+            if submitted >= REFRESH_BATCH_SIZE:
+                return submitted
+            if get_snapshot(user_id, kind) is not None:
+                continue
+            _submit(user_id, kind, state['auth_manager'], save, background=True)
+            submitted += 1
+    return submitted
+
+
+def _scheduler_loop():
+    while True:
+        time.sleep(REFRESH_INTERVAL)
+        try:
+            refresh_stale()
+        except Exception:
+            logger.warning("Snapshot refresh failed", exc_info=True)
+
+
+def _ensure_scheduler():
+    global _scheduler
+    if not SCHEDULER_ENABLED or _scheduler is not None:
+        return
+    with _lock:
+        if _scheduler is None:
+            _scheduler = threading.Thread(target=_scheduler_loop, name='snapshot-scheduler', daemon=True)
+            _scheduler.start()
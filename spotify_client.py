@@ -0,0 +1,84 @@
+import hashlib
+import os
+
+import requests
+import spotipy
+import urllib3
+
+import instrumentation
+from spotify_scheduler import SpotifyBusy, retry_after, scheduler
+
+# One pooled HTTP session for every Spotify client in the process, so
+# keep-alive connections (and their TLS handshakes) to api.spotify.com are
+# reused across requests, gunicorn threads and the fetch_engine pool.
+POOL_MAXSIZE = int(os.environ.get('SPOTIFY_POOL_MAXSIZE', 32))
+# Point every client somewhere other than api.spotify.com, e.g. the fake
+# API the load tests run against
+API_URL = os.environ.get('SPOTIFY_API_URL')
+# 429s are retried by the scheduler, after the whole app has waited out Retry-After
+RATE_LIMIT_RETRIES = 3
+
+
+class CountingRetry(urllib3.Retry):
+    # Counts every retry (and every 429) towards the endpoint's /metrics
+    def increment(self, method=None, url=None, response=None, *args, **kwargs):
+        instrumentation.record_retry('spotify', instrumentation.spotify_endpoint(method, url or ''),
+                                     getattr(response, 'status', None))
+        return super().increment(method, url, response, *args, **kwargs)
+
+
+def _build_http_session():
+    http_session = requests.Session()
+    # Same retry policy spotipy builds for its own sessions
+    retry = CountingRetry(
+        total=spotipy.Spotify.max_retries,
+        connect=None,
+        read=False,
+        allowed_methods=frozenset(['GET', 'POST', 'PUT', 'DELETE']),
+        status=spotipy.Spotify.max_retries,
+        backoff_factor=0.3,
+        # 429s are left to _internal_call so the scheduler can pause every caller
+        status_forcelist=[code for code in spotipy.Spotify.default_retry_codes if code != 429])
+    adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=POOL_MAXSIZE, max_retries=retry)
+    http_session.mount('https://', adapter)
+    http_session.mount('http://', adapter)
+    return http_session
+
+
+http_session = _build_http_session()
+
+
+class SpotifyClient(spotipy.Spotify):
+    def __init__(self, **kwargs):
+        kwargs.setdefault('requests_session', http_session)
+        super().__init__(**kwargs)
+        if API_URL:
+            self.prefix = API_URL
+
+    def _internal_call(self, method, url, payload, params):
+        full_url = url if url.startswith('http') else self.prefix + url
+        endpoint = instrumentation.spotify_endpoint(method, full_url)
+        # Budget per user token; spotipy resolves (and refreshes) it the same way
+        user_key = hashlib.sha1(self._auth_headers().get('Authorization', '').encode()).hexdigest()
+
+        for attempt in range(RATE_LIMIT_RETRIES + 1):
+            waited = scheduler.acquire(user_key)
+            if waited > 0.001:
+                instrumentation.record('queue', endpoint, waited)
+            try:
+                with instrumentation.timed('spotify', endpoint):
+                    # spotipy pops content_type out of params, so each attempt gets a copy
+                    return super()._internal_call(method, url, payload, dict(params))
+            except spotipy.SpotifyException as e:
+                if e.http_status != 429:
+                    raise
+                instrumentation.record_retry('spotify', endpoint, 429)
+                seconds = retry_after(e.headers)
+                scheduler.pause(seconds)
+                if attempt == RATE_LIMIT_RETRIES:
+                    raise SpotifyBusy(seconds) from e
+
+    def __del__(self):
+        # spotipy closes its session when the client is garbage collected;
+        # the shared session has to outlive any single client.
+        pass
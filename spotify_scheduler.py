@@ -0,0 +1,174 @@
+"""
+Every Spotify call asks this scheduler for a slot first (see
+SpotifyClient._internal_call), so the process stays under Spotify's rate
+limit instead of finding it through 429 storms.
+
+  - a token bucket for the whole app (SPOTIFY_RATE_LIMIT calls/sec, bursts
+    of SPOTIFY_BURST) and one per user token (SPOTIFY_USER_RATE_LIMIT,
+    SPOTIFY_USER_BURST), so one big blend can't use up everyone's quota
+  - a 429 pauses the whole app for its Retry-After, then the call is retried
+  - two lanes: 'interactive' (page loads, the default) and 'background'
+    (scheduled snapshot refreshes). Background calls only go when no
+    interactive call is waiting.
+  - load shedding: a call that would wait longer than its lane allows
+    (SPOTIFY_MAX_WAIT for interactive calls), or join a queue that is
+    already too long, fails straight away with SpotifyBusy, which the app
+    turns into a 503 with Retry-After
+
+The limits are per process; with several gunicorn workers divide the app
+limit between them.
+"""
+
+import contextvars
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+APP_RATE = float(os.environ.get('SPOTIFY_RATE_LIMIT', 20))
+APP_BURST = float(os.environ.get('SPOTIFY_BURST', 40))
+USER_RATE = float(os.environ.get('SPOTIFY_USER_RATE_LIMIT', 10))
+USER_BURST = float(os.environ.get('SPOTIFY_USER_BURST', 20))
+MAX_WAIT = {
+    'interactive': float(os.environ.get('SPOTIFY_MAX_WAIT', 5)),
+    'background': 60.0,
+}
+MAX_QUEUE = {
+    'interactive': 500,
+    'background': 100,
+}
+MAX_USER_BUCKETS = 10000
+DEFAULT_RETRY_AFTER = 1.0
+MAX_RETRY_AFTER = 30.0
+
+_lane = contextvars.ContextVar('spotify_lane', default='interactive')
+
+
+class SpotifyBusy(Exception):
+    """Spotify calls are backed up (or rate limited) past what this request can wait."""
+
+    def __init__(self, retry_after):
+        self.retry_after = max(1, round(retry_after))
+        super().__init__(f"Spotify is busy right now, please try again in {self.retry_after} seconds.")
+
+
+class TokenBucket:
+    def __init__(self, rate, burst, now):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = now
+
+    def refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self):
+        # Seconds until a token is available, as of the last refill
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+
+class Scheduler:
+    def __init__(self, rate=APP_RATE, burst=APP_BURST, user_rate=USER_RATE, user_burst=USER_BURST):
+        now = time.monotonic()
+        self.user_rate = user_rate
+        self.user_burst = user_burst
+        self.app_bucket = TokenBucket(rate, burst, now)
+        self.user_buckets = OrderedDict()  # user key -> TokenBucket, least recently used first
+        self.paused_until = 0.0
+        self.waiting = {'interactive': 0, 'background': 0}
+        self.shed = 0
+        self.rate_limited = 0
+        self._cond = threading.Condition()
+
+    def _user_bucket(self, key, now):
+        bucket = self.user_buckets.get(key)
+        if bucket is None:
+            bucket = self.user_buckets[key] = TokenBucket(self.user_rate, self.user_burst, now)
+            if len(self.user_buckets) > MAX_USER_BUCKETS:
+                self.user_buckets.popitem(last=False)
+        else:
+            self.user_buckets.move_to_end(key)
+        return bucket
+
+    def _wait_time(self, user_bucket, lane, now):
+        self.app_bucket.refill(now)
+        user_bucket.refill(now)
+        wait = max(self.paused_until - now, self.app_bucket.wait_time(), user_bucket.wait_time())
+        if wait == 0 and lane == 'background' and self.waiting['interactive']:
+            # Yield to page loads; check again shortly
+            wait = 1 / self.app_bucket.rate
+        return wait
+
+    def acquire(self, key, lane=None):
+        """Block until `key` (a user token) may make a call. Returns the seconds spent waiting."""
+        lane = lane or _lane.get()
+        start = time.monotonic()
+        deadline = start + MAX_WAIT[lane]
+        with self._cond:
+            user_bucket = self._user_bucket(key, start)
+            # Rough estimate of this call's wait: everyone queued ahead in
+            # its lane (and the interactive lane, for background calls) at the app rate
+            ahead = self.waiting[lane] + (self.waiting['interactive'] if lane == 'background' else 0)
+            estimate = max(self.paused_until - start, 0) + ahead / self.app_bucket.rate
+            if self.waiting[lane] >= MAX_QUEUE[lane] or estimate > MAX_WAIT[lane]:
+                self.shed += 1
+                raise SpotifyBusy(estimate)
+
+            self.waiting[lane] += 1
+            try:
+                while True:
+                    now = time.monotonic()
+                    wait = self._wait_time(user_bucket, lane, now)
+                    if wait == 0:
+                        self.app_bucket.tokens -= 1
+                        user_bucket.tokens -= 1
+                        return now - start
+                    if now + wait > deadline:
+                        self.shed += 1
+                        raise SpotifyBusy(wait)
+                    self._cond.wait(wait)
+            finally:
+                self.waiting[lane] -= 1
+                self._cond.notify_all()
+
+    def pause(self, retry_after):
+        # A 429: nobody calls Spotify until Retry-After has passed
+        with self._cond:
+            self.rate_limited += 1
+            self.paused_until = max(self.paused_until, time.monotonic() + retry_after)
+            self.app_bucket.tokens = min(self.app_bucket.tokens, 0)
+            self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            return {
+                'waiting_interactive': self.waiting['interactive'],
+                'waiting_background': self.waiting['background'],
+                'shed': self.shed,
+                'rate_limited': self.rate_limited,
+                'paused_for': max(self.paused_until - time.monotonic(), 0),
+            }
+
+
+scheduler = Scheduler()
+
+
+@contextmanager
+def lane(name):
+    """Run the calls made inside (including fetch_engine fan-out) in the given lane."""
+    token = _lane.set(name)
+    try:
+        yield
+    finally:
+        _lane.reset(token)
+
+
+def retry_after(headers):
+    # Spotify sends Retry-After (in seconds) with its 429s
+    value = (headers or {}).get('Retry-After') or (headers or {}).get('retry-after')
+    try:
+        return min(float(value), MAX_RETRY_AFTER)
+    except (TypeError, ValueError):
+        return DEFAULT_RETRY_AFTER
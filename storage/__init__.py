@@ -0,0 +1,52 @@
+"""
+Storage for user favorites, summaries and per-user settings.
+
+    STORAGE_BACKEND=firestore  (default) Google Cloud Firestore
+    STORAGE_BACKEND=sqlite     a WAL-mode SQLite file at STORAGE_PATH, for
+                               single-node deployments
+    STORAGE_BACKEND=memory     a process-local dict, for running offline and
+                               load tests
+
+The backend is built on first use, so importing the app doesn't construct
+any clients.
+"""
+
+import os
+import threading
+
+from .base import FavoritesStore, write_stats
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def create_store(backend=None):
+    backend = backend or os.environ.get('STORAGE_BACKEND', 'firestore')
+    if backend == 'firestore':
+        from .firestore_store import FirestoreStore
+        return FirestoreStore()
+    if backend == 'sqlite':
+        from .sqlite_store import SqliteStore
+        return SqliteStore(os.environ.get('STORAGE_PATH', 'bad-playlists.sqlite3'))
+    if backend == 'memory':
+        from .memory_store import MemoryStore
+        return MemoryStore()
+    raise ValueError(f"Unknown STORAGE_BACKEND: {backend}")
+
+
+def get_store():
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = create_store()
+    return _store
+
+
+def set_store(store):
+    # Swap the process-wide store, e.g. for benchmarks against a fake
+    global _store
+    _store = store
+
+
+__all__ = ['FavoritesStore', 'create_store', 'get_store', 'set_store', 'write_stats']
@@ -0,0 +1,91 @@
+import threading
+
+import instrumentation
+from favorites import PAGE_SIZE, RANGES, range_hash
+
+# Favorites saves by outcome, see FavoritesStore.save_favorites()
+write_stats = {'skipped': 0, 'partial': 0, 'full': 0}
+_write_stats_lock = threading.Lock()
+
+# Backend methods that go to the database, timed for /metrics and Server-Timing
+TIMED_METHODS = ['get_favorites', 'get_group_favorites', 'summary_page', 'get_user', 'update_user',
+                 'update_summary_artists', '_stored_hashes', '_write_favorites']
+
+
+class FavoritesStore:
+    """
+    What the app needs from storage. Backends implement the underscored
+    hooks and the read methods; change detection and paging live here.
+    """
+
+    name = 'storage'
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        for method in TIMED_METHODS:
+            if method in cls.__dict__:
+                setattr(cls, method, instrumentation.timed_method(cls.name, method.lstrip('_'), cls.__dict__[method]))
+
+    def get_favorites(self, user_id, kind):
+        """read_favorites() shaped favorites, empty if the user never saved."""
+        raise NotImplementedError
+
+    def get_group_favorites(self, user_ids):
+        """user_id -> {kind: favorites} for every kind, in one round trip."""
+        raise NotImplementedError
+
+    def summary_page(self, cursor=None, page_size=PAGE_SIZE):
+        """One page of summaries ordered by user_id, and the cursor for the next (or None)."""
+        raise NotImplementedError
+
+    def get_user(self, user_id):
+        raise NotImplementedError
+
+    def update_user(self, user_id, fields):
+        raise NotImplementedError
+
+    def update_summary_artists(self, user_id, artists):
+        """Replace the artists slices ({range: [artist]}) of an existing summary."""
+        raise NotImplementedError
+
+    def _stored_hashes(self, user_id, kind):
+        raise NotImplementedError
+
+    def _write_favorites(self, user_id, display_name, kind, ranges, changed, full):
+        """Write the changed ranges (all of them if full) and their summary slices together."""
+        raise NotImplementedError
+
+    def migrate_favorites(self):
+        """Rewrite favorites stored in an older format (see favorites.py). Returns how many were rewritten."""
+        raise NotImplementedError
+
+    def save_favorites(self, user_id, display_name, kind, ranges):
+        """
+        Store a favorites snapshot, writing only what changed since the last save.
+
+        If no range's hash changed the write is skipped, if some did only
+        those ranges (and their summary slices) are written, and without
+        stored hashes the whole thing is. Returns 'skipped', 'partial' or 'full'.
+        """
+        stored_hashes = self._stored_hashes(user_id, kind)
+        changed = [sp_range for sp_range in RANGES if stored_hashes.get(sp_range) != range_hash(ranges[sp_range])]
+
+        if not changed:
+            outcome = 'skipped'
+        else:
+            full = not stored_hashes or len(changed) == len(RANGES)
+            self._write_favorites(user_id, display_name, kind, ranges, changed, full)
+            outcome = 'full' if full else 'partial'
+
+        with _write_stats_lock:
+            write_stats[outcome] += 1
+        return outcome
+
+    def iter_summaries(self, page_size=PAGE_SIZE):
+        # Yields every user one page at a time, so only a page is held in memory.
+        cursor = None
+        while True:
+            users, cursor = self.summary_page(cursor, page_size)
+            yield from users
+            if cursor is None:
+                return
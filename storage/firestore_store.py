@@ -0,0 +1,137 @@
+"""
+Firestore layout:
+
+    users/{user_id}                               per-user settings
+    users/{user_id}/user_favorites/top_{kind}     favorites documents
+    user_summaries/{user_id}                      summaries for /find_users
+"""
+
+import threading
+
+from favorites import (FORMAT_VERSION, ID_FIELDS, KINDS, PAGE_SIZE, RANGES, encode_range, favorites_document,
+                       is_current, range_hash, read_favorites, read_summary, summary_document, top_by_range)
+from .base import FavoritesStore
+
+WRITE_BATCH_SIZE = 500  # Firestore's limit on writes per batch
+
+
+class FirestoreStore(FavoritesStore):
+    name = 'firestore'
+
+    def __init__(self, db=None):
+        self._db = db
+        self._db_lock = threading.Lock()
+
+    @property
+    def db(self):
+        # Built on first use rather than at import
+        if self._db is None:
+            with self._db_lock:
+                if self._db is None:
+                    from google.cloud import firestore
+                    self._db = firestore.Client()
+        return self._db
+
+    def favorites_ref(self, user_id, kind):
+        return self.db.collection('users').document(user_id).collection('user_favorites').document(f'top_{kind}')
+
+    def summary_ref(self, user_id):
+        return self.db.collection('user_summaries').document(user_id)
+
+    def get_favorites(self, user_id, kind):
+        return read_favorites(kind, self.favorites_ref(user_id, kind).get().to_dict())
+
+    def get_group_favorites(self, user_ids):
+        refs = [self.favorites_ref(user_id, kind) for user_id in user_ids for kind in KINDS]
+        group = {user_id: {} for user_id in user_ids}
+        for doc in self.db.get_all(refs):
+            user_id = doc.reference.parent.parent.id
+            kind = doc.id[len('top_'):]
+            group[user_id][kind] = read_favorites(kind, doc.to_dict() if doc.exists else None)
+        return group
+
+    def summary_page(self, cursor=None, page_size=PAGE_SIZE):
+        # Cursor-based paging: start_after the last user_id of the previous page
+        query = self.db.collection('user_summaries').order_by('user_id')
+        if cursor:
+            query = query.start_after({'user_id': cursor})
+        users = [read_summary(doc.id, doc.to_dict()) for doc in query.limit(page_size).stream()]
+        next_cursor = users[-1]['user_id'] if len(users) == page_size else None
+        return users, next_cursor
+
+    def get_user(self, user_id):
+        doc = self.db.collection('users').document(user_id).get()
+        return doc.to_dict() if doc.exists else {}
+
+    def update_user(self, user_id, fields):
+        self.db.collection('users').document(user_id).set(fields, merge=True)
+
+    def update_summary_artists(self, user_id, artists):
+        # A top-level field in update() replaces the whole map
+        self.summary_ref(user_id).update({'artists': artists})
+
+    def _stored_hashes(self, user_id, kind):
+        # A small, field-masked read
+        stored = self.favorites_ref(user_id, kind).get(field_paths=['hashes']).to_dict() or {}
+        return stored.get('hashes', {})
+
+    def _write_favorites(self, user_id, display_name, kind, ranges, changed, full):
+        # Write the favorites and the /find_users summary together in one round trip
+        ref = self.favorites_ref(user_id, kind)
+        batch = self.db.batch()
+        if full:
+            batch.set(ref, favorites_document(kind, ranges))
+        else:
+            # Changed ranges are written in the current format; untouched ones
+            # stay as they were and are still read, so the document is the new version
+            changes = {'version': FORMAT_VERSION}
+            for sp_range in changed:
+                changes[f'ranges.{sp_range}'] = encode_range(kind, ranges[sp_range])
+                changes[f'hashes.{sp_range}'] = range_hash(ranges[sp_range])
+            batch.update(ref, changes)
+        summary = summary_document(user_id, display_name, kind, {sp_range: ranges[sp_range] for sp_range in changed})
+        batch.set(self.summary_ref(user_id), summary, merge=True)
+        batch.commit()
+
+    def backfill_summaries(self, lookup_display_name):
+        # One pass over every favorites document, then batched summary writes.
+        # Used for users who saved favorites before summaries existed.
+        summaries = {}
+        for doc in self.db.collection_group('user_favorites').stream():
+            user_id = doc.reference.parent.parent.id
+            summary = summaries.setdefault(user_id, {'user_id': user_id})
+            kind = doc.id[len('top_'):]
+            if kind in ID_FIELDS:
+                summary[kind] = top_by_range(kind, read_favorites(kind, doc.to_dict())['ranges'])
+
+        user_ids = list(summaries)
+        for start in range(0, len(user_ids), WRITE_BATCH_SIZE):
+            batch = self.db.batch()
+            for user_id in user_ids[start:start + WRITE_BATCH_SIZE]:
+                summary = summaries[user_id]
+                summary['display_name'] = lookup_display_name(user_id)
+                batch.set(self.summary_ref(user_id), summary, merge=True)
+            batch.commit()
+        return len(user_ids)
+
+    def migrate_favorites(self):
+        # Rewrite favorites documents stored in an older format, in batches
+        migrated = 0
+        batch = self.db.batch()
+        pending = 0
+        for doc in self.db.collection_group('user_favorites').stream():
+            kind = doc.id[len('top_'):]
+            data = doc.to_dict() or {}
+            if kind not in ID_FIELDS or is_current(data):
+                continue
+            batch.set(doc.reference, favorites_document(kind, read_favorites(kind, data)['ranges']))
+            pending += 1
+            if pending == WRITE_BATCH_SIZE:
+                batch.commit()
+                migrated += pending
+                batch = self.db.batch()
+                pending = 0
+        if pending:
+            batch.commit()
+            migrated += pending
+        return migrated
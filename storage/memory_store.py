@@ -0,0 +1,82 @@
+import bisect
+import copy
+import threading
+
+from favorites import (KINDS, PAGE_SIZE, encode_range, favorites_document, is_current, range_hash, read_favorites,
+                       read_summary, top_by_range)
+from .base import FavoritesStore
+
+
+class MemoryStore(FavoritesStore):
+    """Everything in process-local dicts. Reads hand out copies, like a real database would."""
+
+    name = 'memory'
+
+    def __init__(self):
+        self._favorites = {}  # (user_id, kind) -> favorites document
+        self._summaries = {}  # user_id -> summary
+        self._summary_ids = []  # sorted user_ids, for paging
+        self._users = {}
+        self._lock = threading.Lock()
+
+    def get_favorites(self, user_id, kind):
+        with self._lock:
+            data = copy.deepcopy(self._favorites.get((user_id, kind)))
+        return read_favorites(kind, data)
+
+    def get_group_favorites(self, user_ids):
+        with self._lock:
+            data = {(user_id, kind): copy.deepcopy(self._favorites.get((user_id, kind)))
+                    for user_id in user_ids for kind in KINDS}
+        return {user_id: {kind: read_favorites(kind, data[(user_id, kind)]) for kind in KINDS}
+                for user_id in user_ids}
+
+    def summary_page(self, cursor=None, page_size=PAGE_SIZE):
+        with self._lock:
+            start = bisect.bisect_right(self._summary_ids, cursor) if cursor else 0
+            page_ids = self._summary_ids[start:start + page_size]
+            users = [read_summary(user_id, copy.deepcopy(self._summaries[user_id])) for user_id in page_ids]
+        next_cursor = users[-1]['user_id'] if len(users) == page_size else None
+        return users, next_cursor
+
+    def get_user(self, user_id):
+        with self._lock:
+            return dict(self._users.get(user_id, {}))
+
+    def update_user(self, user_id, fields):
+        with self._lock:
+            self._users.setdefault(user_id, {}).update(fields)
+
+    def update_summary_artists(self, user_id, artists):
+        with self._lock:
+            self._summaries[user_id]['artists'] = copy.deepcopy(artists)
+
+    def _stored_hashes(self, user_id, kind):
+        with self._lock:
+            return dict(self._favorites.get((user_id, kind), {}).get('hashes', {}))
+
+    def _write_favorites(self, user_id, display_name, kind, ranges, changed, full):
+        ranges = copy.deepcopy(ranges)
+        with self._lock:
+            if full:
+                self._favorites[(user_id, kind)] = favorites_document(kind, ranges)
+            else:
+                document = self._favorites[(user_id, kind)]
+                for sp_range in changed:
+                    document['ranges'][sp_range] = encode_range(kind, ranges[sp_range])
+                    document['hashes'][sp_range] = range_hash(ranges[sp_range])
+
+            if user_id not in self._summaries:
+                bisect.insort(self._summary_ids, user_id)
+                self._summaries[user_id] = {'user_id': user_id}
+            summary = self._summaries[user_id]
+            summary['display_name'] = display_name
+            summary.setdefault(kind, {}).update(top_by_range(kind, {sp_range: ranges[sp_range] for sp_range in changed}))
+
+    def migrate_favorites(self):
+        # Rewrite favorites documents stored in an older format
+        with self._lock:
+            stale = [(key, document) for key, document in self._favorites.items() if not is_current(document)]
+            for (user_id, kind), document in stale:
+                self._favorites[(user_id, kind)] = favorites_document(kind, read_favorites(kind, document)['ranges'])
+        return len(stale)
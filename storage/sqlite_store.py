@@ -0,0 +1,163 @@
+"""
+SQLite layout (WAL mode, one connection per thread):
+
+    favorite_ranges  one row per (user_id, kind, range): the encoded range
+                     (JSON columns, or compressed bytes) + hash
+    user_summaries   one row per user: display name + JSON top-5 slices
+    users            one row per user: JSON settings
+"""
+
+import json
+import sqlite3
+import threading
+
+from favorites import (KINDS, PAGE_SIZE, RANGES, encode_range, is_current_range, range_hash, read_favorites,
+                       read_summary, top_by_range)
+from .base import FavoritesStore
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS favorite_ranges (
+    user_id TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    range TEXT NOT NULL,
+    entries TEXT NOT NULL,
+    hash TEXT NOT NULL,
+    PRIMARY KEY (user_id, kind, range)
+) WITHOUT ROWID;
+-- Every query goes by user_id, so the primary key is the only index; databases
+-- created with the old (kind, range) index drop it
+DROP INDEX IF EXISTS favorite_ranges_by_range;
+
+CREATE TABLE IF NOT EXISTS user_summaries (
+    user_id TEXT PRIMARY KEY,
+    display_name TEXT,
+    artists TEXT,
+    tracks TEXT
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS users (
+    user_id TEXT PRIMARY KEY,
+    data TEXT NOT NULL
+) WITHOUT ROWID;
+'''
+
+
+def range_column(kind, entries):
+    # Compressed ranges go in as BLOBs, the rest as JSON text
+    encoded = encode_range(kind, entries)
+    return encoded if isinstance(encoded, bytes) else json.dumps(encoded, separators=(',', ':'))
+
+
+def stored_range(value):
+    return value if isinstance(value, bytes) else json.loads(value)
+
+
+class SqliteStore(FavoritesStore):
+    name = 'sqlite'
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._conn().executescript(SCHEMA)
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def _read_ranges(self, rows):
+        # rows of (user_id, kind, range, entries) -> {(user_id, kind): {'ranges': ...}}
+        documents = {}
+        for user_id, kind, sp_range, entries in rows:
+            document = documents.setdefault((user_id, kind), {'ranges': {}})
+            document['ranges'][sp_range] = stored_range(entries)
+        return documents
+
+    def get_favorites(self, user_id, kind):
+        rows = self._conn().execute(
+            'SELECT user_id, kind, range, entries FROM favorite_ranges WHERE user_id = ? AND kind = ?',
+            (user_id, kind)).fetchall()
+        return read_favorites(kind, self._read_ranges(rows).get((user_id, kind)))
+
+    def get_group_favorites(self, user_ids):
+        placeholders = ','.join('?' * len(user_ids))
+        rows = self._conn().execute(
+            f'SELECT user_id, kind, range, entries FROM favorite_ranges WHERE user_id IN ({placeholders})',
+            list(user_ids)).fetchall() if user_ids else []
+        documents = self._read_ranges(rows)
+        return {user_id: {kind: read_favorites(kind, documents.get((user_id, kind))) for kind in KINDS}
+                for user_id in user_ids}
+
+    def summary_page(self, cursor=None, page_size=PAGE_SIZE):
+        rows = self._conn().execute(
+            'SELECT user_id, display_name, artists, tracks FROM user_summaries WHERE user_id > ? '
+            'ORDER BY user_id LIMIT ?', (cursor or '', page_size)).fetchall()
+        users = []
+        for user_id, display_name, artists, tracks in rows:
+            data = {'user_id': user_id, 'display_name': display_name}
+            if artists:
+                data['artists'] = json.loads(artists)
+            if tracks:
+                data['tracks'] = json.loads(tracks)
+            users.append(read_summary(user_id, data))
+        next_cursor = users[-1]['user_id'] if len(users) == page_size else None
+        return users, next_cursor
+
+    def get_user(self, user_id):
+        row = self._conn().execute('SELECT data FROM users WHERE user_id = ?', (user_id,)).fetchone()
+        return json.loads(row[0]) if row else {}
+
+    def update_user(self, user_id, fields):
+        conn = self._conn()
+        with conn:
+            conn.execute('BEGIN IMMEDIATE')
+            data = self.get_user(user_id)
+            data.update(fields)
+            conn.execute('INSERT OR REPLACE INTO users VALUES (?, ?)', (user_id, json.dumps(data)))
+
+    def update_summary_artists(self, user_id, artists):
+        self._conn().execute('UPDATE user_summaries SET artists = ? WHERE user_id = ?', (json.dumps(artists), user_id))
+
+    def _stored_hashes(self, user_id, kind):
+        rows = self._conn().execute('SELECT range, hash FROM favorite_ranges WHERE user_id = ? AND kind = ?',
+                                    (user_id, kind)).fetchall()
+        return dict(rows)
+
+    def _write_favorites(self, user_id, display_name, kind, ranges, changed, full):
+        conn = self._conn()
+        with conn:
+            conn.execute('BEGIN IMMEDIATE')
+            conn.executemany('INSERT OR REPLACE INTO favorite_ranges VALUES (?, ?, ?, ?, ?)', [
+                (user_id, kind, sp_range, range_column(kind, ranges[sp_range]), range_hash(ranges[sp_range]))
+                for sp_range in (RANGES if full else changed)
+            ])
+
+            row = conn.execute(f'SELECT {kind} FROM user_summaries WHERE user_id = ?', (user_id,)).fetchone()
+            summary = json.loads(row[0]) if row and row[0] else {}
+            summary.update(top_by_range(kind, {sp_range: ranges[sp_range] for sp_range in changed}))
+            conn.execute(f'INSERT INTO user_summaries (user_id, display_name, {kind}) VALUES (?, ?, ?) '
+                         f'ON CONFLICT (user_id) DO UPDATE SET display_name = excluded.display_name, '
+                         f'{kind} = excluded.{kind}',
+                         (user_id, display_name, json.dumps(summary)))
+
+    def migrate_favorites(self):
+        # Rewrite ranges stored in an older format; their hashes stay valid
+        conn = self._conn()
+        migrated = 0
+        with conn:
+            conn.execute('BEGIN IMMEDIATE')
+            rows = conn.execute('SELECT user_id, kind, range, entries FROM favorite_ranges').fetchall()
+            for user_id, kind, sp_range, entries in rows:
+                stored = stored_range(entries)
+                if is_current_range(stored):
+                    continue
+                data = {'ranges': {sp_range: stored}}
+                conn.execute('UPDATE favorite_ranges SET entries = ? WHERE user_id = ? AND kind = ? AND range = ?',
+                             (range_column(kind, read_favorites(kind, data)['ranges'][sp_range]), user_id, kind,
+                              sp_range))
+                migrated += 1
+        return migrated